@@ -0,0 +1,209 @@
+"""
+asyncio control server of ELSIM
+serves the line protocol of protocol.py (or binproto.py) to any number of
+connections on one event loop, instead of one thread per connection
+"""
+import asyncio
+import threading
+
+from protocol import PROMPT, command_table, execute, lookup, encode, decode
+import binproto
+
+LINE_LIMIT = 4096  # longest accepted command line in bytes
+PUSH_LIMIT = 1 << 20  # events are dropped while a client has this much unread
+
+
+class AsyncElevatorServer:
+    """Serve the control protocol for elevator on host:port.
+    on_terminate is called when a client sends terminate."""
+
+    def __init__(self, elevator, port=23300, host="localhost",
+                 on_terminate=None, notifier=None, channel=None,
+                 stepper=None):
+        self.elevator = elevator
+        self.notifier = notifier
+        self.channel = channel
+        self.stepper = stepper
+        self.port = port
+        self.host = host
+        self.on_terminate = on_terminate
+        self.loop = None
+        self._stopped = None
+        self._handlers = set()
+        self.ready = threading.Event()
+        self.error = None  # why serve() failed to start
+
+    async def serve(self):
+        """Run the server until stop() is called."""
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle, self.host,
+                                                self.port, limit=LINE_LIMIT)
+        except OSError as e:
+            self.error = e
+            raise
+        finally:
+            self.ready.set()
+        async with server:
+            await self._stopped.wait()
+            server.close()
+            handlers = list(self._handlers)
+            for handler in handlers:
+                handler.cancel()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await server.wait_closed()
+
+    def stop(self):
+        """Stop serving, can be called from any thread."""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    def start_in_thread(self):
+        """Run the server on its own event loop in a background thread;
+        raises the error if it cannot listen."""
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        if not self.ready.wait(5):
+            raise TimeoutError("server on %s:%d did not start"
+                               % (self.host, self.port))
+        if self.error is not None:
+            raise self.error
+        return thread
+
+    def _run(self):
+        try:
+            asyncio.run(self.serve())
+        except OSError:
+            pass  # raised by start_in_thread()
+
+    def _terminate(self):
+        if self.on_terminate:
+            self.on_terminate()
+        self._stopped.set()
+
+    def open_connection(self, connection):
+        """Set up a new connection: attach it to the elevator."""
+        self.attach(connection, self.elevator, self.notifier, self.channel,
+                    self._terminate, self.stepper)
+
+    def attach(self, connection, elevator, notifier, channel, terminate,
+               stepper=None):
+        """Make connection control elevator (through channel, if given)."""
+        self.detach(connection)
+        connection.elevator = elevator
+        connection.notifier = notifier
+        connection.client = channel and channel.client()
+        connection.terminate = terminate
+        connection.stepper = stepper
+        connection.flist = command_table(elevator, terminate, connection.end,
+                                         notifier, connection.push,
+                                         connection.client, stepper)
+
+    def detach(self, connection):
+        if connection.notifier is not None:
+            connection.notifier.unsubscribe(connection.push)
+        connection.elevator = connection.notifier = connection.client = None
+        connection.stepper = None
+        connection.flist = {}
+
+    async def _serve_binary(self, reader, writer, connection):
+        client = connection.client
+        frames = binproto.binary_table(connection.elevator,
+                                       connection.terminate, connection.end,
+                                       client, connection.stepper)
+        size = binproto.REQUEST.size
+        while connection.open:
+            try:
+                frame = await reader.readexactly(size)
+            except asyncio.IncompleteReadError:
+                break  # connection closed by the client
+            opcode, _, argument = binproto.REQUEST.unpack(frame)
+            f = frames.get(opcode)
+            if getattr(f, "blocking", False):
+                reply = await self.loop.run_in_executor(
+                    None, binproto.execute_frame, frames, opcode, argument)
+            else:
+                reply = binproto.execute_frame(frames, opcode, argument)
+            writer.write(reply)
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self._handlers.add(asyncio.current_task())
+
+        def write_event(data):
+            if (not writer.is_closing() and
+                    writer.transport.get_write_buffer_size() < PUSH_LIMIT):
+                writer.write(data)
+
+        def push(text):
+            # called from the simulation thread
+            self.loop.call_soon_threadsafe(write_event,
+                                           encode("%s\r\n" % text))
+
+        connection = Connection(push)
+        self.open_connection(connection)
+        first_line = True
+        try:
+            writer.write(encode(PROMPT))
+            while connection.open:
+                try:
+                    line = await reader.readline()
+                except ValueError:  # line longer than LINE_LIMIT
+                    writer.write(encode("line too long\r\n"))
+                    break
+                if not line:  # connection closed by the client
+                    break
+                line = decode(line)
+                if first_line and line.strip() == binproto.HELLO and \
+                   connection.elevator is not None:
+                    connection.binary = True
+                    reply = "OK %d" % connection.elevator.levels
+                else:
+                    f, _ = lookup(connection.flist, line.strip())
+                    if getattr(f, "blocking", False):
+                        # waits for the simulation thread, not on the loop
+                        reply = await self.loop.run_in_executor(
+                            None, execute, connection.flist, line)
+                    else:
+                        reply = execute(connection.flist, line)
+                first_line = False
+                if reply is not None:
+                    writer.write(encode("%s\r\n" % reply))
+                if connection.binary:
+                    await self._serve_binary(reader, writer, connection)
+                    break
+                if connection.open:
+                    writer.write(encode(PROMPT))
+                # wait while the client does not read its replies
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # client gone or server shutting down
+        finally:
+            self.detach(connection)
+            self.close_connection(connection)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    def close_connection(self, connection):
+        """Called when a connection ended."""
+
+
+class Connection:
+    """State of one connection of AsyncElevatorServer; push sends an
+    event line to it. Set binary to switch it to binproto after the
+    current reply."""
+
+    def __init__(self, push):
+        self.push = push
+        self.open = True
+        self.binary = False
+        self.elevator = None
+        self.notifier = None
+        self.client = None
+        self.terminate = None
+        self.stepper = None
+        self.flist = {}
+
+    def end(self):
+        self.open = False
@@ -0,0 +1,144 @@
+"""
+Vectorized elevator bank
+the state of many cars (optionally in many buildings) kept in NumPy arrays
+of shape (buildings, cars) and advanced all at once with the same
+accelerate/brake, clamp and overheat rules as ElevatorCore.update()
+"""
+import numpy as np
+
+from simcore import PHYSICS
+
+# motor status codes of ElevatorBank.motor_status()
+OK, OVERHEATING, BROKEN = 0, 1, 2
+STATUS_NAMES = ("ok", "overheating", "broken")
+
+
+class ElevatorBank:
+    """cars elevators in each of buildings buildings.
+    levels is a single number or one number per building."""
+    overheat_low = PHYSICS["overheat_low"]
+    overheat_max = PHYSICS["overheat_max"]
+    maxspeed = PHYSICS["maxspeed"]
+    speedstep = PHYSICS["speedstep"]
+    door_step = PHYSICS["door_step"]
+
+    def __init__(self, cars, levels, buildings=1):
+        shape = (buildings, cars)
+        self.shape = shape
+        levels = np.asarray(levels, dtype=np.int64).reshape(-1, 1)
+        if levels.shape[0] not in (1, buildings):
+            raise ValueError("need one levels value per building")
+        self.levels = np.broadcast_to(levels, shape).copy()
+        self.position = np.zeros(shape)
+        self.speed = np.zeros(shape)
+        self.door_position = np.zeros(shape)
+        self.direction = np.zeros(shape, dtype=np.int8)
+        self.door_motor = np.zeros(shape, dtype=np.int8)
+        self.motor_overheat = np.zeros(shape, dtype=np.int32)
+        self.door_motor_overheat = np.zeros(shape, dtype=np.int32)
+        self.defect = np.zeros(shape, dtype=bool)
+        self.door_defect = np.zeros(shape, dtype=bool)
+
+    def update(self):
+        """Advance all cars by one tick."""
+        speed = self.speed
+        direction = self.direction
+        # check updates of speed
+        stopping = direction == 0
+        braking_up = stopping & (speed > 0.00001)
+        braking_down = stopping & (speed < -0.00001)
+        faster = ((direction == 1) & (speed < self.maxspeed)) | braking_down
+        slower = ((direction == -1) & (speed > -self.maxspeed)) | braking_up
+        np.add(speed, self.speedstep, out=speed, where=faster)
+        np.subtract(speed, self.speedstep, out=speed, where=slower)
+        speed[stopping & ~braking_up & ~braking_down] = 0
+        # update position of elevators
+        self._move(self.position, speed / self.levels, ~self.defect,
+                   self.motor_overheat)
+        # update doors
+        door_speed = self.door_motor * self.door_step
+        self._move(self.door_position, door_speed, ~self.door_defect,
+                   self.door_motor_overheat)
+        # burnt out motors
+        self.defect |= self.motor_overheat >= self.overheat_max
+        self.door_defect |= self.door_motor_overheat >= self.overheat_max
+
+    @staticmethod
+    def _move(position, delta, working, overheat):
+        """Move position by delta where working, clamp it to [0,1] and
+        heat up the motors running against the limits, cool down the others."""
+        np.add(position, delta, out=position, where=working)
+        low = working & (position < 0)
+        high = working & (position > 1)
+        position[low] = 0
+        position[high] = 1
+        clamped = low | high
+        overheat += clamped
+        overheat -= working & ~clamped & (overheat > 0)
+
+    def run(self, ticks):
+        """Run ticks ticks as fast as possible."""
+        update = self.update
+        for _ in range(ticks):
+            update()
+
+    # sensors, vectorized over all cars
+    def is_door_closed(self):
+        return self.door_position <= 0.1
+    def is_door_open(self):
+        return self.door_position >= 0.9
+    def current_level(self):
+        return (self.position*(self.levels-1) + 0.5).astype(np.int64)
+    def save_to_open_door(self):
+        scaled = self.position*(self.levels-1)
+        delta = np.trunc(scaled) - scaled
+        return (delta < 0.04) & (delta > -0.04)
+    def _status(self, overheat):
+        status = np.where(overheat < self.overheat_low, OK, OVERHEATING)
+        status[overheat >= self.overheat_max] = BROKEN
+        return status
+    def motor_status(self):
+        """Status codes OK, OVERHEATING, BROKEN."""
+        return self._status(self.motor_overheat)
+    def door_motor_status(self):
+        return self._status(self.door_motor_overheat)
+
+    # commands, for all cars or the cars selected by index
+    def up(self, index=Ellipsis):
+        self.direction[index] = 1
+    def down(self, index=Ellipsis):
+        self.direction[index] = -1
+    def stop(self, index=Ellipsis):
+        self.direction[index] = 0
+    def door_open(self, index=Ellipsis):
+        self.door_motor[index] = 1
+    def door_close(self, index=Ellipsis):
+        self.door_motor[index] = -1
+    def door_stop(self, index=Ellipsis):
+        self.door_motor[index] = 0
+    def repair(self, index=Ellipsis):
+        self.motor_overheat[index] = 0
+        self.direction[index] = 0
+        self.speed[index] = 0
+        self.defect[index] = False
+    def repair_door(self, index=Ellipsis):
+        self.door_motor_overheat[index] = 0
+        self.door_motor[index] = 0
+        self.door_defect[index] = False
+
+    # exchange with single elevators
+    _fields = ("position", "speed", "door_position", "direction",
+               "door_motor", "motor_overheat", "door_motor_overheat",
+               "defect", "door_defect")
+
+    def load(self, elevator, building, car):
+        """Copy the state of a single ElevatorCore into one car."""
+        if elevator.levels != self.levels[building, car]:
+            raise ValueError("elevator has a different number of levels")
+        for field in self._fields:
+            getattr(self, field)[building, car] = getattr(elevator, field)
+
+    def store(self, elevator, building, car):
+        """Copy the state of one car into a single ElevatorCore."""
+        for field in self._fields:
+            setattr(elevator, field, getattr(self, field)[building, car].item())
@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+"""
+Benchmarks of ELSIM
+raw simulation ticks, rendering per phase, cold startup versus levels,
+round trips through the control protocol, hall call waits of a group of
+cars and seeded checks that the faster models match the tick model; every
+result is printed as one JSON object per line so runs can be compared
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+
+from simcore import ElevatorCore, Simulation, TICK_RATE
+from eventsim import EventSimulation
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values)-1, int(p/100.0*len(values)))]
+
+
+def commute(sim, ticks):
+    """Drive the car up and down, opening the door at the ends."""
+    elevator = sim.elevator
+    leg = max(1, ticks // 8)
+    while ticks > 0:
+        for command in (elevator.up, elevator.stop, elevator.door_open,
+                        elevator.door_close, elevator.down, elevator.stop,
+                        elevator.door_open, elevator.door_close):
+            command()
+            sim.run(min(leg, ticks))
+            ticks -= leg
+            if ticks <= 0:
+                break
+
+
+def bench_ticks(args):
+    """Simulated ticks per second of ElevatorCore.update() and of the
+    event-driven simulation."""
+    results = []
+    for name, simulation in (("tick", Simulation),
+                             ("event-driven", EventSimulation)):
+        sim = simulation(ElevatorCore(args.levels), rate=None)
+        start = time.perf_counter()
+        commute(sim, args.ticks)
+        elapsed = time.perf_counter() - start
+        results.append({"benchmark": "ticks", "mode": name,
+                        "levels": args.levels, "ticks": sim.tick,
+                        "seconds": elapsed,
+                        "ticks_per_second": sim.tick / elapsed})
+    return results
+
+
+def bench_render(args):
+    """Time per frame of the main() loop of gui.py, by phase."""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    import gui
+    from elsim import VISIBLE_LEVELS
+    pygame.display.init()
+    pygame.font.init()
+    view = gui.Viewport(args.levels, VISIBLE_LEVELS)
+    screen = pygame.display.set_mode((250, view.height))
+    background = gui.create_background(screen)
+    elevator = ElevatorCore(args.levels)
+    car = gui.ElevatorSprite(elevator)
+    building = gui.Building(args.levels)
+    statistics = gui.StatisticsPanel(background)
+    buttons = gui.ButtonPanel(background)
+    sim = Simulation(elevator)
+    elevator.up()
+    elevator.door_open()
+    phases = ("events", "input", "physics", "car", "statistics", "buttons",
+              "display")
+    totals = dict.fromkeys(phases, 0.0)
+    frames = []
+    clock = time.perf_counter
+    for frame in range(args.frames):
+        if frame % 200 == 100:
+            elevator.down()
+            elevator.door_close()
+        elif frame % 200 == 0:
+            elevator.up()
+            elevator.door_open()
+        t0 = clock()
+        pygame.event.get()
+        t1 = clock()
+        gui.read_buttons(car, view)
+        t2 = clock()
+        sim.step()
+        t3 = clock()
+        view.track(car)
+        if view.moved:  # scrolled after the car, counted as car
+            dirty = gui.draw_view(screen, background, car, building,
+                                  statistics, buttons, view)
+        else:
+            dirty = gui.draw_car(screen, background, car, building, view)
+        t4 = clock()
+        dirty += statistics.draw(screen, elevator)
+        t5 = clock()
+        dirty += buttons.draw(screen, car, view)
+        t6 = clock()
+        pygame.display.update(dirty)
+        t7 = clock()
+        for phase, seconds in zip(phases, (t1-t0, t2-t1, t3-t2, t4-t3,
+                                          t5-t4, t6-t5, t7-t6)):
+            totals[phase] += seconds
+        frames.append(t7 - t0)
+    pygame.quit()
+    return [{"benchmark": "render", "levels": args.levels,
+             "frames": args.frames,
+             "frame_ms_mean": 1000 * sum(frames) / len(frames),
+             "frame_ms_p95": 1000 * percentile(frames, 95),
+             "phase_ms_mean": {phase: 1000 * totals[phase] / args.frames
+                               for phase in phases}}]
+
+
+def startup_child(levels):
+    """Run in a fresh process: time import, pygame init and first frame."""
+    t0 = time.perf_counter()
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    import gui
+    from elsim import VISIBLE_LEVELS
+    t1 = time.perf_counter()
+    pygame.display.init()
+    pygame.font.init()
+    view = gui.Viewport(levels, VISIBLE_LEVELS)
+    screen = pygame.display.set_mode((250, view.height))
+    t2 = time.perf_counter()
+    background = gui.create_background(screen)
+    elevator = ElevatorCore(levels)
+    car = gui.ElevatorSprite(elevator)
+    building = gui.Building(levels)
+    t3 = time.perf_counter()
+    view.track(car)
+    gui.draw_view(screen, background, car, building,
+                  gui.StatisticsPanel(background),
+                  gui.ButtonPanel(background), view)
+    pygame.display.flip()
+    t4 = time.perf_counter()
+    print(json.dumps({"import": t1-t0, "init": t2-t1, "objects": t3-t2,
+                      "first_frame": t4-t3}))
+
+
+def bench_startup(args):
+    """Cold startup time (fresh process) versus levels."""
+    results = []
+    for levels in args.startup_levels:
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, __file__, "_startup",
+                              str(levels)], check=True, capture_output=True,
+                             text=True).stdout
+        elapsed = time.perf_counter() - start
+        phases = json.loads(out.strip().splitlines()[-1])
+        results.append({"benchmark": "startup", "levels": levels,
+                        "process_seconds": elapsed, "phase_seconds": phases})
+    return results
+
+
+def read_prompts(conn, count, buffer=b""):
+    """Read until count prompts arrived, return the rest after the last."""
+    while buffer.count(b"# ") < count:
+        chunk = conn.recv(65536)
+        if not chunk:
+            raise ConnectionError("server closed the connection")
+        buffer += chunk
+    return buffer.split(b"# ")[-1]
+
+
+def bench_protocol(args):
+    """Round-trip latency and pipelined throughput of serve_connection,
+    with commands going through a Channel of a running simulation as in
+    elsim.start_server()."""
+    import elsim
+    from notify import Notifier
+    from channel import Channel
+    sim = Simulation(ElevatorCore(args.levels), rate=args.protocol_rate)
+    notifier = Notifier(sim.elevator)
+    sim.tick_hooks.append(notifier.poll)
+    channel = Channel(sim.elevator, sim.tick)
+    sim.tick_hooks.append(channel)
+    stop = threading.Event()
+    ticker = threading.Thread(target=sim.run_forever, args=(stop.is_set,))
+    ticker.start()
+    server, client = socket.socketpair()
+    thread = threading.Thread(target=elsim.serve_connection,
+                              args=(server, None, sim.elevator, notifier,
+                                    channel))
+    thread.start()
+    commands = [b"level?\n", b"speed?\n", b"door open?\n", b"buttons?\n",
+                b"status?\n", b"up\n"]
+    read_prompts(client, 1)
+    latencies = []
+    for i in range(args.requests):
+        command = commands[i % len(commands)]
+        start = time.perf_counter()
+        client.sendall(command)
+        read_prompts(client, 1)
+        latencies.append(time.perf_counter() - start)
+    batch = b"".join(commands[i % len(commands)] for i in range(args.batch))
+    start = time.perf_counter()
+    for _ in range(max(1, args.requests // args.batch)):
+        client.sendall(batch)
+        read_prompts(client, args.batch)
+    pipelined = time.perf_counter() - start
+    client.sendall(b"exit\n")
+    thread.join()
+    client.close()
+    stop.set()
+    ticker.join()
+    requests = max(1, args.requests // args.batch) * args.batch
+    return [{"benchmark": "protocol", "levels": args.levels,
+             "rate": args.protocol_rate, "requests": args.requests,
+             "latency_us_mean": 1e6 * sum(latencies) / len(latencies),
+             "latency_us_p50": 1e6 * percentile(latencies, 50),
+             "latency_us_p99": 1e6 * percentile(latencies, 99),
+             "round_trips_per_second": len(latencies) / sum(latencies),
+             "pipelined_batch": args.batch,
+             "pipelined_requests_per_second": requests / pipelined}]
+
+
+# commands sent at random by the equivalence checks, and the state compared
+RANDOM_COMMANDS = ("up", "down", "stop", "door_open", "door_close",
+                   "door_stop", "repair", "repair_door")
+STATE_FIELDS = ("position", "speed", "door_position", "direction",
+                "door_motor", "motor_overheat", "door_motor_overheat",
+                "defect", "door_defect")
+
+
+def differences(expected, actual):
+    """Names of the STATE_FIELDS in which two elevators differ."""
+    return [field for field in STATE_FIELDS
+            if getattr(expected, field) != getattr(actual, field)]
+
+
+def check_bank(args):
+    """ElevatorBank against one ElevatorCore per car, both sent the same
+    seeded random commands; cars are compared every 50 ticks."""
+    from bank import ElevatorBank, STATUS_NAMES
+    rnd = random.Random(args.seed)
+    levels = [3, args.levels, 4*args.levels]
+    cars = 4
+    bank = ElevatorBank(cars, levels, len(levels))
+    cores = [[ElevatorCore(n) for _ in range(cars)] for n in levels]
+    scratch = [ElevatorCore(n) for n in levels]
+    mismatches, first = 0, None
+    start = time.perf_counter()
+    for tick in range(1, args.equivalence_ticks + 1):
+        for building, row in enumerate(cores):
+            for car, elevator in enumerate(row):
+                if rnd.random() < 0.01:
+                    command = rnd.choice(RANDOM_COMMANDS)
+                    getattr(elevator, command)()
+                    getattr(bank, command)((building, car))
+                elevator.update()
+        bank.update()
+        if tick % 50:
+            continue
+        status = bank.motor_status()
+        for building, row in enumerate(cores):
+            for car, elevator in enumerate(row):
+                bank.store(scratch[building], building, car)
+                fields = differences(elevator, scratch[building])
+                if STATUS_NAMES[status[building, car]] != elevator.motor_status():
+                    fields.append("motor_status")
+                if fields:
+                    mismatches += 1
+                    first = first or "tick %d car %d,%d: %s" % (
+                        tick, building, car, " ".join(fields))
+    return [{"benchmark": "equivalence", "mode": "bank", "seed": args.seed,
+             "levels": levels, "cars": cars,
+             "ticks": args.equivalence_ticks,
+             "seconds": time.perf_counter() - start,
+             "mismatches": mismatches, "first_mismatch": first}]
+
+
+def check_events(args):
+    """EventSimulation against Simulation, both sent the same seeded random
+    commands between runs of random length, and the tick of every event
+    of next_event() against the tick the tick model shows it at."""
+    from eventsim import observe
+    rnd = random.Random(args.seed)
+    mismatches, first = 0, None
+    start = time.perf_counter()
+    for run in range(10):
+        levels = rnd.choice([3, args.levels, 4*args.levels])
+        ticks = Simulation(ElevatorCore(levels))
+        events = EventSimulation(ElevatorCore(levels))
+        while ticks.tick < args.equivalence_ticks:
+            gap = rnd.choice([1, 5, 50, 300, 3000])
+            ticks.run(gap)
+            events.run(gap)
+            fields = differences(ticks.elevator, events.elevator)
+            if observe(ticks.elevator) != observe(events.elevator):
+                fields.append("observables")
+            if fields:
+                mismatches += 1
+                first = first or "run %d tick %d: %s" % (
+                    run, ticks.tick, " ".join(fields))
+            command = rnd.choice(RANDOM_COMMANDS)
+            getattr(ticks.elevator, command)()
+            getattr(events.elevator, command)()
+        # the same trip once more, event by event
+        ticks = Simulation(ElevatorCore(levels))
+        events = EventSimulation(ElevatorCore(levels))
+        ticks.elevator.up()
+        events.elevator.up()
+        before = after = observe(ticks.elevator)
+        while events.next_event(limit=args.equivalence_ticks - events.tick):
+            while after == before and ticks.tick < events.tick:
+                ticks.step()
+                after = observe(ticks.elevator)
+            if after == before or ticks.tick != events.tick:
+                mismatches += 1
+                first = first or "run %d: event at tick %d, tick model %d" % (
+                    run, events.tick, ticks.tick)
+                break
+            before = after
+    return [{"benchmark": "equivalence", "mode": "event-driven",
+             "seed": args.seed, "ticks": args.equivalence_ticks,
+             "seconds": time.perf_counter() - start,
+             "mismatches": mismatches, "first_mismatch": first}]
+
+
+def bench_equivalence(args):
+    """Seeded checks that bank.py and eventsim.py match the tick model."""
+    return check_bank(args) + check_events(args)
+
+
+def bench_group(args):
+    """controllers.NearestCarGroup dispatching the same seeded hall calls
+    over one car and over --cars cars: the waits for the calls and the
+    calls still unserved ten minutes after the last one (should be none).
+    A served hall call presses a level button on its car."""
+    from controllers import NearestCarGroup
+    levels = args.levels
+    chance = 1.0 / (args.call_interval * TICK_RATE)  # of a call per tick
+    drain = 600 * TICK_RATE
+    results = []
+    for cars in sorted({1, args.cars}):
+        rnd = random.Random(args.seed)  # the calls
+        riders = random.Random(args.seed)  # their destinations
+        sims = [Simulation(ElevatorCore(levels), rate=None)
+                for _ in range(cars)]
+        group = NearestCarGroup([sim.elevator for sim in sims])
+        pressed = {}  # hall call -> tick
+        held = []  # (elevator, button) pressed for one tick
+        waits = []
+        start = time.perf_counter()
+        for tick in range(args.group_ticks + drain):
+            for elevator, name in held:
+                elevator.button_states[name] = False
+            held = []
+            if tick < args.group_ticks and rnd.random() < chance:
+                floor = rnd.randrange(levels)
+                kind = rnd.choice(["up", "down"]) if 0 < floor < levels-1 \
+                       else ("up" if floor == 0 else "down")
+                name = "%s %d" % (kind, floor + 1)
+                if name not in pressed:
+                    elevator = rnd.choice(sims).elevator
+                    elevator.button_states[name] = True
+                    held.append((elevator, name))
+                    pressed[name] = tick
+            for sim in sims:
+                sim.step()
+            assigned = dict(group.assigned)
+            group(sims)
+            for name, car in assigned.items():
+                if name in group.assigned:
+                    continue
+                waits.append((tick - pressed.pop(name)) / TICK_RATE)
+                kind, floor = name.split(" ")
+                floor = int(floor) - 1
+                destination = riders.randrange(floor + 1, levels) \
+                    if kind == "up" else riders.randrange(floor)
+                name = "level %d" % (destination + 1)
+                car.elevator.button_states[name] = True
+                held.append((car.elevator, name))
+            if tick >= args.group_ticks and not pressed and \
+               not any(car.calls for car in group.cars):
+                break
+        elapsed = time.perf_counter() - start
+        results.append({"benchmark": "group", "cars": cars,
+                        "levels": levels, "seed": args.seed,
+                        "ticks": sims[0].tick, "seconds": elapsed,
+                        "calls": len(waits) + len(pressed),
+                        "wait_mean": sum(waits) / len(waits) if waits
+                                     else 0.0,
+                        "wait_p95": percentile(waits, 95) if waits else 0.0,
+                        "unserved": len(pressed) + sum(
+                            len(car.calls) for car in group.cars)})
+    return results
+
+
+BENCHMARKS = {"ticks": bench_ticks, "render": bench_render,
+              "startup": bench_startup, "protocol": bench_protocol,
+              "equivalence": bench_equivalence, "group": bench_group}
+
+
+def main(*arg):
+    """Run the benchmarks and print one JSON result per line."""
+    if arg[:1] == ("_startup",):
+        return startup_child(int(arg[1]))
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help="any of %s, all by default" % ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument("--levels", type=int, default=10)
+    parser.add_argument("--ticks", type=int, default=200000)
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--startup-levels", type=int, nargs="+",
+                        default=[10, 50, 200])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--protocol-rate", type=float, default=TICK_RATE,
+                        help="ticks per second of the simulation behind "
+                             "the protocol benchmark, 0 unpaced")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random commands of the equivalence checks")
+    parser.add_argument("--equivalence-ticks", type=int, default=20000,
+                        help="ticks of each equivalence check")
+    parser.add_argument("--cars", type=int, default=3,
+                        help="cars of the group benchmark")
+    parser.add_argument("--call-interval", type=float, default=20.0,
+                        help="mean seconds between hall calls of the group "
+                             "benchmark")
+    parser.add_argument("--group-ticks", type=int, default=TICK_RATE*1800,
+                        help="ticks in which the group benchmark makes calls")
+    parser.add_argument("--output", help="also append the results to this file")
+    args = parser.parse_args(arg)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %s" % name)
+    machine = {"python": platform.python_version(),
+               "machine": platform.machine(), "node": platform.node()}
+    mismatches = 0
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        for result in BENCHMARKS[name](args):
+            result.update(machine=machine, time=time.time())
+            mismatches += result.get("mismatches", 0) + \
+                          result.get("unserved", 0)
+            line = json.dumps(result)
+            print(line)
+            if args.output:
+                with open(args.output, "a") as f:
+                    f.write(line + "\n")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*(sys.argv)[1:]))
@@ -0,0 +1,172 @@
+"""
+The binary control protocol of ELSIM
+opt-in alternative to the line protocol for programs: a connection whose
+first line is "binary" is answered with "OK <levels>" and from then on
+sends fixed-size request frames and gets framed replies; the state comes
+as one packed record instead of many formatted queries
+"""
+import struct
+
+from simcore import button_names
+from protocol import COMMANDS
+
+HELLO = "binary"  # the first line requesting binary mode
+
+REQUEST = struct.Struct("<BBH")  # opcode, reserved, argument
+REPLY = struct.Struct("<BBH")  # opcode, status, payload length
+
+# reply status
+OK, UNKNOWN_OPCODE, BAD_ARGUMENT, NOT_LOCKSTEP = range(4)
+
+# opcodes; the elevator commands in the order of protocol.COMMANDS
+(UP, DOWN, STOP, OPEN_DOOR, CLOSE_DOOR, STOP_DOOR, REPAIR,
+ REPAIR_DOOR) = range(1, 9)
+LAMP_ON = 9  # argument: button index in simcore.button_names() order
+LAMP_OFF = 10
+LAMPS_OFF = 11  # all lamps
+STATE = 16  # payload: STATE_RECORD and the button masks
+PING = 17
+STEP = 18  # argument: ticks, lockstep mode only; payload: TICK
+SYNC = 19  # waits until the earlier commands are applied; payload: TICK
+EXIT = 32
+TERMINATE = 33
+
+# tick, level, position, speed, door position, direction, door motor,
+# FLAG_* bits, motor status, door motor status (0 ok, 1 overheating,
+# 2 broken); followed by the pressed buttons and the lit lamps as bit masks
+# of mask_size(levels) bytes each, in button_names() order
+STATE_RECORD = struct.Struct("<QidddbbBBB")
+FLAG_DOOR_OPEN, FLAG_DOOR_CLOSED, FLAG_SAVE_TO_OPEN, FLAG_DEFECT, \
+    FLAG_DOOR_DEFECT = (1 << i for i in range(5))
+STATUS_CODES = {"ok": 0, "overheating": 1, "broken": 2}
+TICK = struct.Struct("<Q")  # 64 bits, max speed passes 2**32 in hours
+
+
+def mask_size(levels):
+    return (len(button_names(levels)) + 7) // 8
+
+
+def pack_state(state, tick=0):
+    """The STATE payload for an elevator or a channel.Snapshot."""
+    flags = (state.is_door_open() and FLAG_DOOR_OPEN) | \
+            (state.is_door_closed() and FLAG_DOOR_CLOSED) | \
+            (state.save_to_open_door() and FLAG_SAVE_TO_OPEN) | \
+            (state.defect and FLAG_DEFECT) | \
+            (state.door_defect and FLAG_DOOR_DEFECT)
+    return STATE_RECORD.pack(
+        getattr(state, "tick", tick), state.current_level(), state.position,
+        state.speed, state.door_position, state.direction, state.door_motor,
+        flags, STATUS_CODES[state.motor_status()],
+        STATUS_CODES[state.door_motor_status()]) + \
+        state.button_states.to_bytes() + state.button_lamps.to_bytes()
+
+
+def unpack_state(payload, levels):
+    """Decode a STATE payload into a dict."""
+    (tick, level, position, speed, door_position, direction, door_motor,
+     flags, motor, door_motor_status) = STATE_RECORD.unpack_from(payload)
+    names = button_names(levels)
+    size = mask_size(levels)
+    pressed = int.from_bytes(payload[STATE_RECORD.size:
+                                     STATE_RECORD.size+size], "little")
+    lamps = int.from_bytes(payload[STATE_RECORD.size+size:], "little")
+    return {"tick": tick, "level": level, "position": position,
+            "speed": speed, "door_position": door_position,
+            "direction": direction, "door_motor": door_motor,
+            "door_open": bool(flags & FLAG_DOOR_OPEN),
+            "door_closed": bool(flags & FLAG_DOOR_CLOSED),
+            "save_to_open": bool(flags & FLAG_SAVE_TO_OPEN),
+            "defect": bool(flags & FLAG_DEFECT),
+            "door_defect": bool(flags & FLAG_DOOR_DEFECT),
+            "motor_status": motor, "door_motor_status": door_motor_status,
+            "pressed": {name for i, name in enumerate(names)
+                        if pressed >> i & 1},
+            "lamps": {name for i, name in enumerate(names)
+                      if lamps >> i & 1}}
+
+
+def binary_table(elevator, terminate, end_connection, client=None,
+                 stepper=None):
+    """Return the opcode -> function table for one binary connection; a
+    function is called with the argument of the frame and returns the
+    status and the payload. client and stepper (a lockstep.Stepper) are as
+    for protocol.command_table()."""
+    names = button_names(elevator.levels)
+    if client is None:
+        view = lambda: elevator
+        submit = lambda line, f: f()
+    else:
+        view, submit = client.view, client.submit
+
+    def write(line, f):
+        def command(argument):
+            submit(line, f)
+            return OK, b""
+        return command
+
+    def lamp(switch):
+        def command(argument):
+            if argument >= len(names):
+                return BAD_ARGUMENT, b""
+            name = names[argument]
+            submit("lamp %s %s" % (name, switch),
+                   lambda: getattr(elevator, "lamp_" + switch)(name))
+            return OK, b""
+        return command
+
+    def control(f):
+        def command(argument):
+            f()
+            return OK, b""
+        return command
+
+    def step(argument):
+        if stepper.scale:
+            return NOT_LOCKSTEP, b""
+        if argument == 0:
+            return BAD_ARGUMENT, b""
+        tick, _ = stepper.step(argument)
+        return OK, TICK.pack(tick)
+    step.blocking = True
+
+    def sync(argument):
+        return OK, TICK.pack(client.sync().tick)
+    sync.blocking = True
+
+    table = {opcode: write(line, getattr(elevator, method))
+             for opcode, (line, method) in enumerate(COMMANDS.items(), UP)}
+    table[LAMP_ON] = lamp("on")
+    table[LAMP_OFF] = lamp("off")
+    table[LAMPS_OFF] = write("lamps off", elevator.lamps_off)
+    table[STATE] = lambda argument: (OK, pack_state(view()))
+    table[PING] = lambda argument: (OK, b"")
+    table[EXIT] = control(end_connection)
+    table[TERMINATE] = control(terminate)
+    if client is not None:
+        table[SYNC] = sync
+    if stepper is not None:
+        table[STEP] = step
+    return table
+
+
+def execute_frame(table, opcode, argument):
+    """The reply frame for one request."""
+    f = table.get(opcode)
+    if f is None:
+        return REPLY.pack(opcode, UNKNOWN_OPCODE, 0)
+    status, payload = f(argument)
+    return REPLY.pack(opcode, status, len(payload)) + payload
+
+
+def execute_frames(table, data, is_open=lambda: True):
+    """Execute all complete request frames in data, return the replies and
+    the unfinished rest; stops when is_open() turns false."""
+    out = []
+    size = REQUEST.size
+    end = len(data) - len(data) % size
+    offset = 0
+    while offset < end and is_open():
+        opcode, _, argument = REQUEST.unpack_from(data, offset)
+        offset += size
+        out.append(execute_frame(table, opcode, argument))
+    return b"".join(out), data[offset:]
@@ -0,0 +1,146 @@
+"""
+Shared state of ELSIM for the connections
+commands from connection threads go to a queue which the simulation applies
+between two ticks; reads are served from an immutable snapshot published
+after each tick, so they never see a half updated elevator
+"""
+import threading
+import collections
+
+from simcore import ElevatorCore
+
+
+class Snapshot:
+    """The state of an elevator after a tick, never changed once published.
+    It answers the same queries as ElevatorCore. applied is the number of
+    the last command applied before it was taken."""
+    __slots__ = ("tick", "applied", "levels", "position", "speed",
+                 "direction", "door_position", "door_motor", "defect",
+                 "door_defect", "motor_overheat", "door_motor_overheat",
+                 "overheat_low", "overheat_max", "button_states",
+                 "button_lamps")
+
+    def __init__(self, elevator, tick, applied, previous=None):
+        e = elevator
+        self.tick = tick
+        self.applied = applied
+        self.levels = e.levels
+        self.position = e.position
+        self.speed = e.speed
+        self.direction = e.direction
+        self.door_position = e.door_position
+        self.door_motor = e.door_motor
+        self.defect = e.defect
+        self.door_defect = e.door_defect
+        self.motor_overheat = e.motor_overheat
+        self.door_motor_overheat = e.door_motor_overheat
+        self.overheat_low = e.overheat_low
+        self.overheat_max = e.overheat_max
+        # buttons rarely change, share them with the previous snapshot
+        if previous is not None and previous.button_states == e.button_states:
+            self.button_states = previous.button_states
+        else:
+            self.button_states = e.button_states.frozen()
+        if previous is not None and previous.button_lamps == e.button_lamps:
+            self.button_lamps = previous.button_lamps
+        else:
+            self.button_lamps = e.button_lamps.frozen()
+
+    is_defect = ElevatorCore.is_defect
+    is_door_defect = ElevatorCore.is_door_defect
+    is_door_closed = ElevatorCore.is_door_closed
+    is_door_open = ElevatorCore.is_door_open
+    current_level = ElevatorCore.current_level
+    save_to_open_door = ElevatorCore.save_to_open_door
+    motor_status = ElevatorCore.motor_status
+    door_motor_status = ElevatorCore.door_motor_status
+    lamp = ElevatorCore.lamp
+
+
+class Channel:
+    """Command queue and snapshot of the elevator of a simulation; add it
+    as the last tick hook. observers are called with the line of every
+    command when it is applied (e.g. Journal.command)."""
+    wait_limit = 1.0  # seconds a read waits for its connection's commands
+
+    def __init__(self, elevator, tick=0):
+        self.elevator = elevator
+        self.queue = collections.deque()  # (number, line, function)
+        self.submitted = 0
+        self.lock = threading.Lock()  # numbers the submitted commands
+        self.published = threading.Condition()
+        self.waiting = 0  # readers waiting for a snapshot
+        self.observers = []
+        self.on_submit = None  # called after a command was queued
+        self.snapshot = Snapshot(elevator, tick, 0)
+
+    def submit(self, line, f):
+        """Queue the command f (with its protocol line), return its number."""
+        with self.lock:
+            self.submitted += 1
+            self.queue.append((self.submitted, line, f))
+            number = self.submitted
+        if self.on_submit is not None:
+            self.on_submit()
+        return number
+
+    def apply(self):
+        """Apply the queued commands, in the simulation thread."""
+        applied = self.snapshot.applied
+        queue = self.queue
+        while queue:
+            applied, line, f = queue.popleft()
+            for observer in self.observers:
+                observer(line)
+            f()
+        return applied
+
+    def __call__(self, sim):
+        """Tick hook: apply the commands, then publish the new state."""
+        applied = self.apply() if self.queue else self.snapshot.applied
+        self.snapshot = Snapshot(self.elevator, sim.tick, applied,
+                                 self.snapshot)
+        if self.waiting:
+            with self.published:
+                self.published.notify_all()
+
+    def read(self, applied=0):
+        """The latest snapshot; waits (at most wait_limit seconds) until
+        the command numbered applied is part of it."""
+        snapshot = self.snapshot
+        if snapshot.applied >= applied:
+            return snapshot
+        with self.published:
+            self.waiting += 1
+            try:
+                self.published.wait_for(
+                    lambda: self.snapshot.applied >= applied,
+                    self.wait_limit)
+            finally:
+                self.waiting -= 1
+        return self.snapshot
+
+    def client(self):
+        return Client(self)
+
+
+class Client:
+    """The view of one connection: the latest snapshot, or with sync() the
+    first one showing the connection's own writes."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.last_write = 0
+
+    def submit(self, line, f):
+        self.last_write = self.channel.submit(line, f)
+
+    def synced(self):
+        return self.channel.snapshot.applied >= self.last_write
+
+    def view(self):
+        return self.channel.snapshot
+
+    def sync(self):
+        """Wait until the commands of this connection are applied."""
+        return self.channel.read(self.last_write)
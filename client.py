@@ -0,0 +1,554 @@
+"""
+Python client of the ELSIM control protocol
+Client (blocking) and AsyncClient (asyncio) have one method per command of
+protocol.py returning parsed values: ints, floats, bools, lists and dicts
+instead of reply text. Client.pipeline() sends many commands in one packet;
+AsyncClient pipelines by itself: the requests made in one event loop turn
+go out together and the replies are matched in order. Pushed events are
+kept apart from the replies. ClientPool and AsyncClientPool lend a few
+reusable connections to many controllers.
+
+    with Client("localhost", 23300) as elevator:
+        elevator.up()
+        while elevator.level() < 3: ...
+"""
+import socket
+import asyncio
+import threading
+import contextlib
+import collections
+import queue
+
+from protocol import PROMPT, encode, decode
+from notify import EVENT_PREFIX
+
+REPLY, EVENT = "reply", "event"
+
+
+class CommandError(ValueError):
+    """The server did not accept a command; the message is its reply."""
+
+
+class Replies:
+    """Split the bytes received on a connection into replies (the lines
+    up to the next prompt) and pushed events."""
+    prompt = encode(PROMPT)
+
+    def __init__(self):
+        self.buffer = b""
+        self.lines = []
+
+    def feed(self, data):
+        """Return [(REPLY, text) or (EVENT, text without "event ")] for
+        everything completed by data, in the order received."""
+        buffer = self.buffer + data
+        out = []
+        offset = 0
+        while True:
+            if buffer.startswith(self.prompt, offset):
+                out.append((REPLY, "\r\n".join(self.lines)))
+                self.lines = []
+                offset += len(self.prompt)
+                continue
+            end = buffer.find(b"\r\n", offset)
+            if end < 0:
+                break
+            line = decode(buffer[offset:end])
+            offset = end + 2
+            if line.startswith(EVENT_PREFIX):
+                out.append((EVENT, line[len(EVENT_PREFIX):]))
+            else:
+                self.lines.append(line)
+        self.buffer = buffer[offset:]
+        return out
+
+
+# reply parsers
+def ok(reply):
+    if reply != "OK":
+        raise CommandError(reply)
+
+
+def checked(convert):
+    def parse(reply):
+        try:
+            return convert(reply)
+        except ValueError:
+            raise CommandError(reply) from None
+    return parse
+
+
+def yes(reply):
+    if reply not in ("yes", "no"):
+        raise CommandError(reply)
+    return reply == "yes"
+
+
+def names(reply):
+    return reply.split(",") if reply else []
+
+
+def buttons(reply):
+    states = {}
+    for line in reply.split("\r\n"):
+        name, _, state = line.partition(":")
+        if state not in ("pressed", "released"):
+            raise CommandError(reply)
+        states[name] = state == "pressed"
+    return states
+
+
+def on_off(reply):
+    if reply not in ("on", "off"):
+        raise CommandError(reply)
+    return reply == "on"
+
+
+def speed(reply):
+    return checked(float)(reply)/1000  # the reply is in thousandths
+
+
+def scale(reply):
+    return checked(float)(reply.replace("max", "inf"))
+
+
+def step(reply):
+    tick, *events = reply.split("\r\n")
+    return checked(int)(tick), events
+
+
+STATUS_PARSERS = {"level": checked(int), "door open": yes,
+                  "door closed": yes, "save to open": yes, "speed": speed,
+                  "motor status": str, "door motor": str, "defect": yes,
+                  "door defect": yes, "pressed": names, "lamps": names}
+
+
+def status(reply):
+    fields = {}
+    for line in reply.split("\r\n"):
+        field, _, value = line.partition(":")
+        if field not in STATUS_PARSERS:
+            raise CommandError(reply)
+        fields[field] = STATUS_PARSERS[field](value)
+    return fields
+
+
+def with_list(command, words):
+    """command with a comma separated argument, if any."""
+    if not words:
+        return command
+    return "%s %s" % (command, ",".join(words))
+
+
+class Commands:
+    """The typed commands; _request(line, parse) sends line and returns
+    parse(reply), or what stands for it (a future, a pipeline)."""
+
+    def _request(self, line, parse):
+        raise NotImplementedError
+
+    # moving the car and the door
+    def up(self):
+        return self._request("up", ok)
+
+    def down(self):
+        return self._request("down", ok)
+
+    def stop(self):
+        return self._request("stop", ok)
+
+    def open_door(self):
+        return self._request("open door", ok)
+
+    def close_door(self):
+        return self._request("close door", ok)
+
+    def stop_door(self):
+        return self._request("stop door", ok)
+
+    def repair(self):
+        return self._request("repair", ok)
+
+    def repair_door(self):
+        return self._request("repair door", ok)
+
+    # sensors
+    def level(self):
+        return self._request("level?", checked(int))
+
+    def is_door_open(self):
+        return self._request("door open?", yes)
+
+    def is_door_closed(self):
+        return self._request("door closed?", yes)
+
+    def save_to_open(self):
+        return self._request("save to open?", yes)
+
+    def defect(self):
+        return self._request("defect?", yes)
+
+    def door_defect(self):
+        return self._request("door defect?", yes)
+
+    def motor_status(self):
+        """ok, overheating or broken."""
+        return self._request("motor status?", str)
+
+    def door_motor_status(self):
+        return self._request("door motor?", str)
+
+    def speed(self):
+        """In position units per tick, as ElevatorCore.speed."""
+        return self._request("speed?", speed)
+
+    def status(self, *fields):
+        """A dict of protocol.STATUS_FIELDS (or only fields), all of one
+        tick, parsed like the single queries."""
+        return self._request(with_list("status?", fields), status)
+
+    # buttons and lamps
+    def buttons(self):
+        """A dict button name -> pressed."""
+        return self._request("buttons?", buttons)
+
+    def pressed(self):
+        return self._request("pressed?", names)
+
+    def buttons_mask(self):
+        """The pressed buttons as bits in simcore.button_names() order."""
+        return self._request("buttons mask?", checked(lambda r: int(r, 16)))
+
+    def lamps(self):
+        return self._request("lamps?", names)
+
+    def lamps_mask(self):
+        return self._request("lamps mask?", checked(lambda r: int(r, 16)))
+
+    def lamp(self, name):
+        return self._request("lamp %s?" % name, on_off)
+
+    def set_lamp(self, name, on=True):
+        return self._request("lamp %s %s" % (name, on and "on" or "off"), ok)
+
+    def set_lamps(self, mask):
+        return self._request("lamps mask %x" % mask, ok)
+
+    def lamps_off(self):
+        return self._request("lamps off", ok)
+
+    # events
+    def subscribe(self, *kinds):
+        """Have the notify.EVENT_KINDS kinds (all without) pushed."""
+        return self._request(with_list("subscribe", kinds), ok)
+
+    def unsubscribe(self, *kinds):
+        return self._request(with_list("unsubscribe", kinds), ok)
+
+    def subscriptions(self):
+        return self._request("subscriptions?", names)
+
+    # simulation time (lockstep.py)
+    def tick(self):
+        return self._request("tick?", checked(int))
+
+    def sync(self):
+        """Wait until the earlier commands of this connection are applied,
+        return the tick whose state shows them."""
+        return self._request("sync", checked(int))
+
+    def step(self, ticks=1):
+        """Advance a paused simulation, return the tick reached."""
+        return self._request("step %d" % ticks, lambda r: step(r)[0])
+
+    def step_until(self, *kinds):
+        """Advance a paused simulation until an event of kinds, return the
+        tick and the events."""
+        return self._request("step until %s" % ",".join(kinds), step)
+
+    def time_scale(self):
+        return self._request("time scale?", scale)
+
+    def set_time_scale(self, factor):
+        """factor times real time, math.inf as fast as possible, 0 to
+        pause (lockstep)."""
+        factor = "max" if factor == float("inf") else "%g" % factor
+        return self._request("time scale %s" % factor, ok)
+
+
+class Client(Commands):
+    """Blocking connection to an ELSIM server; can be shared by threads.
+    Events are passed to on_event(text), or kept in events for
+    next_event()."""
+
+    def __init__(self, host="localhost", port=23300, timeout=None,
+                 on_event=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.on_event = on_event
+        self.events = collections.deque()
+        self.replies = Replies()
+        self.received = collections.deque()  # replies not yet claimed
+        self.lock = threading.Lock()
+        with self.lock:
+            self._receive(1)  # the first prompt
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def terminate(self):
+        """Stop the simulator (its last reply is not waited for)."""
+        self.sock.sendall(encode("terminate\n"))
+        self.close()
+
+    def _receive(self, count):
+        while len(self.received) < count:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError("connection closed by the server")
+            self._dispatch(self.replies.feed(data))
+        return [self.received.popleft() for _ in range(count)]
+
+    def _dispatch(self, items):
+        for kind, text in items:
+            if kind is REPLY:
+                self.received.append(text)
+            elif self.on_event is not None:
+                self.on_event(text)
+            else:
+                self.events.append(text)
+
+    def execute(self, requests):
+        """Send the (line, parse) requests at once, return their parsed
+        replies; the first failing one raises CommandError."""
+        if not requests:
+            return []
+        with self.lock:
+            self.sock.sendall(encode("".join("%s\n" % line
+                                             for line, _ in requests)))
+            replies = self._receive(len(requests))
+        return [parse(reply) for (_, parse), reply in zip(requests, replies)]
+
+    def _request(self, line, parse):
+        return self.execute([(line, parse)])[0]
+
+    def pipeline(self):
+        return Pipeline(self)
+
+    def next_event(self, timeout=None):
+        """The next pushed event, waiting at most timeout seconds (None:
+        forever) for it; None when there was none."""
+        with self.lock:
+            if not self.events:
+                default = self.sock.gettimeout()
+                self.sock.settimeout(timeout)
+                try:
+                    while not self.events:
+                        data = self.sock.recv(65536)
+                        if not data:
+                            raise ConnectionError(
+                                "connection closed by the server")
+                        self._dispatch(self.replies.feed(data))
+                except socket.timeout:
+                    return None
+                finally:
+                    self.sock.settimeout(default)
+            return self.events.popleft()
+
+
+class Pipeline(Commands):
+    """Collects the commands called on it and sends them in one packet on
+    execute() (or at the end of a with block, then see results); the
+    results are in the order of the calls."""
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+        self.results = None
+
+    def _request(self, line, parse):
+        self.requests.append((line, parse))
+        return self
+
+    def execute(self):
+        requests, self.requests = self.requests, []
+        self.results = self.client.execute(requests)
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.execute()
+
+
+class AsyncClient(Commands):
+    """asyncio connection to an ELSIM server, made with
+    await AsyncClient.connect(host, port). The command methods return
+    futures; all requests of one event loop turn are written together and
+    the replies come back in order, so concurrent tasks pipeline without
+    trying. Events go to on_event(text) or are kept for next_event()."""
+
+    def __init__(self, reader, writer, on_event=None):
+        self.reader = reader
+        self.writer = writer
+        self.on_event = on_event
+        self.events = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+        self.pending = collections.deque()  # (future, parse) in send order
+        self.outgoing = []
+        self.greeting = self.loop.create_future()
+        self.pending.append((self.greeting, str))
+        self.receiver = self.loop.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, host="localhost", port=23300, on_event=None):
+        reader, writer = await asyncio.open_connection(host, port)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = cls(reader, writer, on_event)
+        await client.greeting
+        return client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        self.receiver.cancel()
+        self.writer.close()
+        with contextlib.suppress(ConnectionError):
+            await self.writer.wait_closed()
+
+    async def terminate(self):
+        """Stop the simulator (its last reply is not waited for)."""
+        self._flush()
+        self.writer.write(encode("terminate\n"))
+        await self.close()
+
+    def _request(self, line, parse):
+        future = self.loop.create_future()
+        if self.receiver.done():
+            future.set_exception(ConnectionError("connection closed"))
+            return future
+        if not self.outgoing:
+            self.loop.call_soon(self._flush)
+        self.outgoing.append(line)
+        self.pending.append((future, parse))
+        return future
+
+    def _flush(self):
+        if self.outgoing:
+            lines, self.outgoing = self.outgoing, []
+            self.writer.write(encode("".join("%s\n" % line
+                                             for line in lines)))
+
+    async def _receive(self):
+        replies = Replies()
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                for kind, text in replies.feed(data):
+                    if kind is EVENT:
+                        if self.on_event is not None:
+                            self.on_event(text)
+                        else:
+                            self.events.put_nowait(text)
+                        continue
+                    future, parse = self.pending.popleft()
+                    if future.cancelled():
+                        continue
+                    try:
+                        future.set_result(parse(text))
+                    except Exception as e:
+                        future.set_exception(e)
+        finally:
+            while self.pending:
+                future, _ = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("connection closed by the server"))
+
+    async def next_event(self, timeout=None):
+        """The next pushed event; None if none came within timeout."""
+        try:
+            return await asyncio.wait_for(self.events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ClientPool:
+    """At most size Clients to host:port, opened when first needed and
+    lent by connection(); for several controllers in one process."""
+
+    def __init__(self, host="localhost", port=23300, size=4, **options):
+        self.host = host
+        self.port = port
+        self.options = options
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextlib.contextmanager
+    def connection(self):
+        self.slots.acquire()
+        try:
+            try:
+                client = self.idle.get_nowait()
+            except queue.Empty:
+                client = Client(self.host, self.port, **self.options)
+            try:
+                yield client
+            except BaseException:
+                client.close()  # maybe out of step with its replies, drop it
+                raise
+            self.idle.put(client)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+class AsyncClientPool:
+    """ClientPool of AsyncClients: async with pool.connection() as client.
+    As an AsyncClient pipelines concurrent requests itself, a pool is
+    only needed to spread the load or to keep pushed events apart."""
+
+    def __init__(self, host="localhost", port=23300, size=4, **options):
+        self.host = host
+        self.port = port
+        self.options = options
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        async with self.slots:
+            if self.idle:
+                client = self.idle.pop()
+            else:
+                client = await AsyncClient.connect(self.host, self.port,
+                                                   **self.options)
+            try:
+                yield client
+            except BaseException:  # also cancelled in the middle of a request
+                await client.close()
+                raise
+            self.idle.append(client)
+
+    async def close(self):
+        while self.idle:
+            await self.idle.pop().close()
@@ -0,0 +1,346 @@
+"""
+In-process elevator controllers
+a controller runs inside the simulation loop (as a tick hook), reads
+button_states directly, latches calls into button_lamps and drives the car
+with up()/down()/stop()/door_open()/door_close()/door_stop(). The scheduling
+algorithm is the choose_target() method; the built-in ones are in
+CONTROLLERS and your own can be added with register_controller() or loaded
+as "module:Class".
+"""
+import math
+import importlib
+
+UP, DOWN = 1, -1
+
+_stop_distances = {}  # (speed, levels, speedstep) -> stopping_distance()
+
+
+def stopping_distance(elevator):
+    """Distance (in position units) the car still travels if it brakes from
+    the next tick on, following the braking rules of ElevatorCore.update()."""
+    key = (elevator.speed, elevator.levels, elevator.speedstep)
+    distance = _stop_distances.get(key)
+    if distance is None:
+        speed = elevator.speed
+        distance = 0
+        while True:
+            if speed > 0.00001:
+                speed -= elevator.speedstep
+            elif speed < -0.00001:
+                speed += elevator.speedstep
+            else:
+                break
+            distance += speed/elevator.levels
+        _stop_distances[key] = distance
+    return distance
+
+
+def parse_call(name):
+    """Split a button name like "up 3" into kind and 0-based floor."""
+    kind, level = name.split(" ")
+    return kind, int(level) - 1
+
+
+class Controller:
+    """Base of the controllers of a single car. Calls are the names of the
+    buttons which were pressed and not served yet; their lamps are on."""
+    dwell = 120  # ticks the door stays open
+    door_margin = 0.03  # where the car is stopped in the save-to-open window
+
+    def __init__(self, elevator):
+        self.elevator = elevator
+        self.calls = set()
+        self.heading = 0  # direction of travel, UP, DOWN or 0
+        self.target = None  # floor driven to
+        self.state = "idle"
+        self.door_opened = 0  # tick the door became open
+
+    # the algorithm
+    def choose_target(self, floor):
+        """Return the floor to serve next or None; floor is the level of
+        the car, self.heading its direction of travel."""
+        raise NotImplementedError
+
+    def served_calls(self, floor):
+        """Calls answered by opening the door on floor."""
+        return [name for name in self.calls if parse_call(name)[1] == floor]
+
+    # the tick hook
+    def __call__(self, sim):
+        self.latch_buttons()
+        getattr(self, "_" + self.state)(sim)
+
+    def quiet_ticks(self, sim):
+        """Ticks in which this controller does nothing unless the elevator
+        state changes observably (see eventsim.EventSimulation)."""
+        if self.state == "idle":
+            return 0 if self.calls or self.heading else math.inf
+        elif self.state == "dwell":
+            return max(0, self.door_opened + self.dwell - sim.tick - 1)
+        elif self.state in ("opening", "closing"):
+            return math.inf  # until the door sensors change
+        elif self.state == "moving" and \
+                self.elevator.speed*self.heading >= self.elevator.maxspeed:
+            # cruising: nothing to do before the braking point
+            elevator = self.elevator
+            stop = (elevator.position + stopping_distance(elevator)) * \
+                   (elevator.levels-1)
+            if self.heading == UP:
+                ahead = self.target - stop
+            else:
+                ahead = stop - self.target - self.door_margin
+            ticks = ahead / abs(elevator.speed/elevator.levels*(elevator.levels-1))
+            return max(0, int(ticks) - 2)
+        return 0
+
+    def latch_buttons(self):
+        elevator = self.elevator
+        for name in elevator.button_states.on():
+            if name not in self.calls:
+                self.calls.add(name)
+                elevator.lamp_on(name)
+
+    def x(self):
+        """Position of the car in level units."""
+        return self.elevator.position*(self.elevator.levels-1)
+
+    def at_floor(self, floor):
+        return floor <= self.x() < floor + 0.04
+
+    def _idle(self, sim):
+        elevator = self.elevator
+        if elevator.speed != 0:
+            return
+        target = self.choose_target(elevator.current_level())
+        if target is None:
+            self.heading = 0
+            return
+        self.target = target
+        if self.at_floor(target):
+            elevator.door_open()
+            self.state = "opening"
+        elif self.x() < target:
+            self.heading = UP
+            elevator.up()
+            self.state = "moving"
+        else:
+            self.heading = DOWN
+            elevator.down()
+            self.state = "moving"
+
+    def _moving(self, sim):
+        elevator = self.elevator
+        # pick up new calls on the way if there is still room to brake
+        target = self.choose_target(elevator.current_level())
+        if target is not None and target != self.target:
+            if self.heading == UP and self.x() < target < self.target:
+                self.target = target
+            elif self.heading == DOWN and self.target < target < self.x():
+                self.target = target
+        stop = (elevator.position + stopping_distance(elevator)) * \
+               (elevator.levels-1)
+        if self.heading == UP and stop >= self.target or \
+           self.heading == DOWN and stop < self.target + self.door_margin:
+            elevator.stop()
+            self.state = "braking"
+
+    def _braking(self, sim):
+        elevator = self.elevator
+        if elevator.speed != 0:
+            return
+        if self.at_floor(self.target) and self.served_calls(self.target):
+            elevator.door_open()
+            self.state = "opening"
+        else:
+            self.state = "idle"  # missed it or nothing to do, plan again
+
+    def _opening(self, sim):
+        elevator = self.elevator
+        if elevator.is_door_open():
+            elevator.door_stop()
+            for name in self.served_calls(self.target):
+                self.calls.discard(name)
+                elevator.lamp_off(name)
+            self.door_opened = sim.tick
+            self.state = "dwell"
+
+    def _dwell(self, sim):
+        if sim.tick - self.door_opened >= self.dwell:
+            self.elevator.door_close()
+            self.state = "closing"
+
+    def _closing(self, sim):
+        elevator = self.elevator
+        # in process we can wait for the door to be shut completely
+        if elevator.door_position <= 0:
+            elevator.door_stop()
+            self.state = "idle"
+
+    # helpers for the algorithms
+    def call_floors(self, kinds=("up", "down", "level")):
+        floors = set()
+        for name in self.calls:
+            kind, floor = parse_call(name)
+            if kind in kinds:
+                floors.add(floor)
+        return floors
+
+
+class NearestCallController(Controller):
+    """Shortest seek first: always serve the nearest call."""
+
+    def choose_target(self, floor):
+        floors = self.call_floors()
+        if not floors:
+            return None
+        return min(floors, key=lambda f: (abs(f - floor), f))
+
+
+class LookController(Controller):
+    """LOOK: serve every call in the direction of travel, turn around when
+    there are no more calls ahead."""
+
+    def choose_target(self, floor):
+        floors = self.call_floors()
+        if not floors:
+            return None
+        heading = self.heading or UP
+        for direction in (heading, -heading):
+            ahead = [f for f in floors if (f - floor)*direction >= 0]
+            if ahead:
+                return min(ahead, key=lambda f: abs(f - floor))
+        return None
+
+
+class ScanController(LookController):
+    """SCAN: like LOOK, but always travels to the last floor before turning
+    around."""
+
+    def choose_target(self, floor):
+        target = LookController.choose_target(self, floor)
+        if target is None:
+            return None
+        heading = self.heading or UP
+        if (target - floor)*heading < 0:
+            # turning around: first go to the end of the building; _idle()
+            # reverses the heading once the car stands there
+            end = self.elevator.levels-1 if heading == UP else 0
+            if end != floor:
+                return end
+        return target
+
+
+class CollectiveController(Controller):
+    """Selective collective control: going up, stop for car calls and up
+    calls above; going down, for car calls and down calls below; a hall call
+    of the other direction is served at the end of the travel."""
+
+    def choose_target(self, floor):
+        if not self.calls:
+            return None
+        heading = self.heading or UP
+        for direction in (heading, -heading):
+            hall = "up" if direction == UP else "down"
+            other = "down" if direction == UP else "up"
+            ahead = [f for f in self.call_floors(("level", hall))
+                     if (f - floor)*direction >= 0]
+            if ahead:
+                return min(ahead, key=lambda f: abs(f - floor))
+            # the farthest call of the other direction ahead
+            ahead = [f for f in self.call_floors((other,))
+                     if (f - floor)*direction >= 0]
+            if ahead:
+                return max(ahead, key=lambda f: abs(f - floor))
+        return None
+
+    def served_calls(self, floor):
+        served = []
+        heading = self.heading
+        above = any(f > floor for f in self.call_floors())
+        below = any(f < floor for f in self.call_floors())
+        for name in self.calls:
+            kind, call_floor = parse_call(name)
+            if call_floor != floor:
+                continue
+            if kind == "level" or heading == 0 or \
+               (kind == "up" and (heading == UP or not below)) or \
+               (kind == "down" and (heading == DOWN or not above)):
+                served.append(name)
+        return served
+
+
+class NearestCarGroup:
+    """Group control of several cars with nearest-car dispatching: a hall
+    call pressed at any car is given to the car which reaches it first
+    (distance, plus a penalty for cars heading away or busy with the door).
+    Call after all cars made their tick."""
+    car_controller = CollectiveController
+    busy_penalty = 2.0
+
+    def __init__(self, elevators, car_controller=None):
+        car_controller = car_controller or self.car_controller
+        self.cars = [car_controller(elevator) for elevator in elevators]
+        self.assigned = {}  # hall call -> controller
+
+    def cost(self, car, floor):
+        distance = abs(car.x() - floor)
+        if car.heading and (floor - car.x())*car.heading < 0:
+            distance += 2*(car.elevator.levels-1)  # has to turn around first
+        if car.state != "idle":
+            distance += self.busy_penalty
+        return distance
+
+    def __call__(self, sims):
+        """sims are the simulations of the cars, in the same order."""
+        for car in self.cars:
+            for name in list(self.assigned):
+                if self.assigned[name] is car and name not in car.calls:
+                    del self.assigned[name]  # served
+        for car in self.cars:
+            for name in car.elevator.button_states.on():
+                if name.startswith("level") or name in self.assigned:
+                    continue
+                floor = parse_call(name)[1]
+                best = min(self.cars, key=lambda c: self.cost(c, floor))
+                self.assigned[name] = best
+                best.calls.add(name)
+                for other in self.cars:
+                    other.elevator.lamp_on(name)
+        for car, sim in zip(self.cars, sims):
+            for name in car.elevator.button_states.on():
+                if name.startswith("level") and name not in car.calls:
+                    car.calls.add(name)
+                    car.elevator.lamp_on(name)
+            getattr(car, "_" + car.state)(sim)
+        # a served hall call turns off its lamp on every car
+        for car in self.cars:
+            for name in car.elevator.button_lamps.on():
+                if not name.startswith("level") and \
+                   name not in self.assigned:
+                    car.elevator.lamp_off(name)
+
+
+CONTROLLERS = {
+    "collective": CollectiveController,
+    "look": LookController,
+    "scan": ScanController,
+    "nearest": NearestCallController,
+}
+
+
+def register_controller(name, controller_class):
+    """Make a Controller subclass available by name."""
+    CONTROLLERS[name] = controller_class
+    return controller_class
+
+
+def load_controller(spec):
+    """Return the controller class for a name in CONTROLLERS or for
+    "module:Class"."""
+    if spec in CONTROLLERS:
+        return CONTROLLERS[spec]
+    module, _, name = spec.partition(":")
+    if not name:
+        raise ValueError("unknown controller %s, known are %s or module:Class"
+                         % (spec, ", ".join(sorted(CONTROLLERS))))
+    return getattr(importlib.import_module(module), name)
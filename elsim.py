@@ -12,324 +12,132 @@ Author: Ulrich Norbisrath
 This is a frontend I developed for my Systems Modeling course
 """
 import sys
+import math
+import queue
 import threading
 import socket
-import pygame
-from pygame.locals import *
+import argparse
+import importlib
+from simcore import ElevatorCore, Simulation, TICK_RATE
+from protocol import PROMPT, command_table, execute_lines, split_lines, encode
+from notify import Notifier
+from controllers import CONTROLLERS, load_controller
+from journal import Journal
+from channel import Channel
+from lockstep import Stepper
+import binproto
 
-if not pygame.font:
-    print('Warning, fonts disabled')
+# subcommands run by the main() of another module, imported only when used
+MODULES = {"run": "simcore", "bench": "bench", "sessions": "sessions"}
+VISIBLE_LEVELS = 16  # default of gui --visible-levels, see gui.py
+PUSH_LIMIT = 1000  # events queued for a connection before they are dropped
 
-if not pygame.mixer:
-    print('Warning, sound disabled')
-
-BUTTON_SIZE = 21
-BUTTON_FONT_SIZE = 13
+# the window moved to gui.py; its names are still found here
+GUI_NAMES = {"BUTTON_SIZE", "BUTTON_FONT_SIZE", "ElevatorSprite",
+             "create_background", "Viewport", "Building", "get_font",
+             "statistics_lines", "StatisticsPanel", "mouse_over_button",
+             "read_buttons", "scroll", "ButtonPanel", "draw_car",
+             "draw_view", "ButtonAtlas", "button_atlas", "Button",
+             "create_buttons"}
 
 terminate = False
 
-class Elevator(pygame.sprite.Sprite):
-    width = 40
-    height = 50
-    levels = 2
-    overheat_low = 6
-    overheat_max = 60
-    color = 200, 0, 0
-    x_offset, y_offset = 5, 5
-    door_motor = 0  # 0:off, 1:opening, -1: closing
-    speed = 0  # [-0.01,0.01] from going down max speed to going up max speed
-    maxspeed = 0.01
-    speedstep = 0.0001
-    direction = 0  # -1 down, 1 up, 0 stop
-    position = 0  # [0,1] from down to up
-    door_position = 0  # [0,1] closed to open
-    defect = False  # Is elevator defect?
-    door_defect = False  # Is elevator door defect?
-    
-    def is_defect(self):
-        return self.defect
-    def is_door_defect(self):
-        return self.door_defect
-    def is_door_closed(self):
-        return self.door_position <= 0.1
-    def is_door_open(self):
-        return self.door_position >= 0.9
-    def current_level(self):
-        return int(self.position*(self.levels-1) + 0.5)
-    def save_to_open_door(self):
-        delta = int(self.position*(self.levels-1)) - \
-                self.position*(self.levels-1)
-        return delta < 0.04 and delta > -0.04
-    def position_to_coordinate(self, position):
-        return (self.levels - 1) * self.height * (1 - position) + self.y_offset
-    def motor_status(self):
-        if self.motor_overheat < self.overheat_low:
-            return "ok"
-        elif self.motor_overheat < self.overheat_max:
-            return "overheating"
-        else:
-            self.defect = True
-            return "broken"
-    def door_motor_status(self):
-        if self.door_motor_overheat < self.overheat_low:
-            return "ok"
-        elif self.door_motor_overheat < self.overheat_max:
-            return "overheating"
-        else:
-            self.door_defect = True
-            return "broken"
-    def _draw_door(self):
-        self.image.fill((0, 0, 0))
-        door_width = (1 - self.door_position) * (self.width/2 - 5)
-        pygame.draw.rect(self.image, self.color,
-                         (0, 0, door_width + 6, self.height))
-        pygame.draw.rect(self.image, self.color,
-                         (self.width-door_width-4, 0, door_width+4, self.height))
-
-    def __init__(self, levels):
-        pygame.sprite.Sprite.__init__(self)  #call Sprite intializer
-        self.levels = levels
-        self.door_motor_overheat = 0
-        self.motor_overheat = 0
-        self.image = pygame.Surface((self.width, self.height))
-        self._draw_door()
-        self.rect = pygame.Rect(
-                (self.x_offset, self.position_to_coordinate(self.position)),
-                (self.width, self.height))
-        self.speed = 0
-        self.buttons = create_buttons(self)
-        self.button_lamps = dict()
-        self.button_states = dict()
-        for (name, released, mouseover, pressed, (x, y)) in self.buttons:
-            self.button_lamps[name] = False
-            self.button_states[name] = False
-
-    def update(self):
-        # check updates of speed
-        if self.direction == 1:
-            if self.speed < self.maxspeed:
-                self.speed += self.speedstep
-        elif self.direction == -1:
-            if self.speed > - self.maxspeed:
-                self.speed -= self.speedstep
-        else: # self.direction == 0
-            if self.speed > 0.00001:
-                self.speed -= self.speedstep
-            elif self.speed < -0.00001:
-                self.speed += self.speedstep
-            else:
-                self.speed = 0
-        if not self.defect:
-            # self.position += self.speed/self.height
-            self.position += self.speed/self.levels
-            # update position of elevator
-            if self.position < 0:
-                self.position = 0
-                self.motor_overheat += 1
-            elif self.position > 1:
-                self.position = 1
-                self.motor_overheat += 1
-            else:
-                # cool down
-                if self.motor_overheat > 0:
-                    self.motor_overheat -= 1
-        self.rect.top = self.position_to_coordinate(self.position)
-        if not self.door_defect:
-            # check door_motor
-            if self.door_motor == -1:
-                self.door_position -= 0.01
-            elif self.door_motor == 1:
-                self.door_position += 0.01
-            # update door
-            if self.door_position < 0:
-                self.door_position = 0
-                self.door_motor_overheat += 1
-            elif self.door_position > 1:
-                self.door_position = 1
-                self.door_motor_overheat += 1
-            else:
-                # cool down
-                if self.door_motor_overheat > 0:
-                    self.door_motor_overheat -= 1
-        self._draw_door()
-
-    def up(self):
-        """Send elevator up. It will first accelerate a bit."""
-        self.direction = 1
-    def down(self):
-        """Send elevator down. It will first accelerate a bit."""
-        self.direction = -1
-    def stop(self):
-        """Stop elevator. It will first break a bit."""
-        self.direction = 0
-    def door_open(self):
-        """Set door motor to open."""
-        self.door_motor = 1
-    def door_close(self):
-        """Set door motor to close."""
-        self.door_motor = -1
-    def door_stop(self):
-        """Stop door motor."""
-        self.door_motor = 0
-    def repair(self):
-        """Repair the elevator motor."""
-        self.motor_overheat = 0
-        self.direction = 0
-        self.speed = 0
-        self.defect = False
-    def repair_door(self):
-        """ Repair the door motor."""
-        self.door_motor_overheat = 0
-        self.door_motor = 0
-        self.door_defect = False
-    def lamp_on(self, name):
-        self.button_lamps[name] = True
-    def lamp_off(self, name):
-        self.button_lamps[name] = False
-    def lamp(self, name):
-        return self.button_lamps[name]
-
-def create_background(screen):
-    background = pygame.Surface(screen.get_size())
-    background = background.convert()
-    background.fill((250, 250, 250))
-    return background
+def __getattr__(name):
+    """Names of GUI_NAMES, from gui.py; pygame is only imported when one
+    of them is used."""
+    if name not in GUI_NAMES:
+        raise AttributeError("module 'elsim' has no attribute %r" % name)
+    import gui
+    return getattr(gui, name)
 
-
-class Building(pygame.sprite.Sprite):
-    def __init__(self, levels):
-        pygame.sprite.Sprite.__init__(self)  #call Sprite intializer
-        self.levels = levels
-        self.image = pygame.Surface((Elevator.width + 3,
-                                     Elevator.height*levels + 3))
-        self.image.set_colorkey((0, 0, 0))
-        self.rect = pygame.Rect(Elevator.x_offset-1, Elevator.y_offset-1,
-                                Elevator.width, Elevator.height)
-        for i in range(levels):
-            pygame.draw.lines(self.image, (0, 0, 255),True,
-                              [(1, i*Elevator.height+1),
-                               (Elevator.width+1, i*Elevator.height+1),
-                               (Elevator.width+1, (i+1)*Elevator.height+1),
-                               (1, (i+1)*Elevator.height+1)], 3)
-
-def draw_statistics(screen, elevator):
-    font = pygame.font.Font("freesansbold.ttf", BUTTON_FONT_SIZE)
-    outputlist = ["level %02d"       % elevator.current_level(),
-                "door open: %s"    %(elevator.is_door_open() and "yes" or "no"),
-                "door closed: %s"  %(elevator.is_door_closed() and "yes" or "no"),
-                "save to open: %s" %(elevator.save_to_open_door() and "yes" or "no"),
-                "motor status: %s" % elevator.motor_status(),
-                "door motor: %s"   % elevator.door_motor_status(),
-                "speed: %s"        %(elevator.speed*1000),
-                "door defect: %s"  %(elevator.is_door_defect() and "yes" or "no"),
-                "motor defect: %s" %(elevator.is_defect() and "yes" or "no"),
-                ]
-    y = elevator.y_offset
-    for output in outputlist:
-        text = font.render(output, 1, (10, 10, 10))
-        textpos = text.get_rect(top=y,left=90)
-        screen.blit(text, textpos)
-        y += 2 + textpos.height
-
-def serve_connection( conn, addr, elevator):
+def request_terminate():
+    """Stop the simulator and all servers."""
     global terminate
-    
+    terminate = True
+
+def serve_connection( conn, addr, elevator, notifier=None, channel=None,
+                      stepper=None):
     release_connection = threading.Lock()
     release_connection.acquire()
+    send_lock = threading.Lock() # replies and pushed events must not mix
+    # events waiting to be sent; dropped while a client has this many unread
+    events = queue.Queue(PUSH_LIMIT)
     
     conn.settimeout(1)
     
-    def help():
-        keys = flist.keys()
-        keys.sort()
-        return "Possible commands: %s"%", ".join(keys)
-    
-    def button_states_list():
-        keys = elevator.button_states.keys()
-        keys.sort()
-        lines = []
-        for key in keys:
-            lines.append("%s:%s"%(key, elevator.button_states[key] and "pressed" or "released"))
-        return "\r\n".join(lines)
-        
-    def quit():
-        global terminate
-        terminate = True
-        return "OK"
-    
     def end_connection():
         release_connection.release()
 
-    # concat two statements
-    def concat(f,s):
-        f()
-        return s
-    
-    # returns a functional operator for returning ok and executing something
-    def ok(f):
-        return lambda: concat(f, "OK")
-    
-    # return functor for returning yes or no depending of result of function
-    def yesno(f):
-        return (lambda: f() and "yes" or "no")
-    
-    flist = {
-        "up": ok(elevator.up),
-        "down": ok(elevator.down),
-        "stop": ok(elevator.stop),
-        "open door": ok(elevator.door_open),
-        "close door": ok(elevator.door_close),
-        "stop door": ok(elevator.door_stop),
-        "repair": ok(elevator.repair),
-        "repair door": ok(elevator.repair_door),
-        "level?": elevator.current_level,
-        "door open?": yesno(elevator.is_door_open),
-        "door closed?": yesno(elevator.is_door_closed),
-        "save to open?": yesno(elevator.save_to_open_door),
-        "defect?": yesno(lambda: elevator.defect),
-        "door defect?": yesno(lambda: elevator.door_defect),
-        "motor status?": elevator.motor_status,
-        "door motor?": elevator.door_motor_status,
-        "speed?": lambda: "%s"%(elevator.speed*1000),
-        "buttons?": button_states_list,
-        "help": help,
-        "terminate": quit,
-        "exit": ok(end_connection)
-    }
-    
-    # add controls for lamps
-    for (name, released, mouseover, pressed,(x, y)) in elevator.buttons:
-        flist["lamp %s?"%name] = lambda x=name: elevator.lamp(x) and "on" or "off"
-        flist["lamp %s on"%name] = ok(lambda x=name: elevator.lamp_on(x))
-        flist["lamp %s off"%name] = ok(lambda x=name: elevator.lamp_off(x))
-        #flist["button %s?"%name] = lambda x=name: elevator.button(x) and "pressed" or "released"
-
-    while not terminate and release_connection.locked():
+    def push(text):
+        # called from the simulation thread, which must never wait for a client
         try:
-            conn.send("# ")
-        except socket.timeout as msg:
+            events.put_nowait(encode("%s\r\n" % text))
+        except queue.Full:
             pass
 
-        data = ""
-        while not terminate and release_connection.locked():
+    def send(data):
+        with send_lock:
+            conn.sendall(data)
+
+    def send_events():
+        while is_open():
+            try:
+                data = events.get(timeout=1)
+            except queue.Empty:
+                continue
             try:
-                data += conn.recv(256)
-                if data[-1] == "\n": # got a line
-                    data = data.strip()
-                    if not data:
-                        break
-                    if data in flist:
-                        conn.send(f"{flist[data]()}\r\n")
-                        break
-                    else:
-                        conn.send("unknown command\r\n")
-                        break
+                send(data)
+            except OSError:
+                break
+
+    client = channel and channel.client()
+    flist = command_table(elevator, request_terminate, end_connection,
+                          notifier, push, client, stepper)
+    frames = None # the binary command table, once requested
+
+    def is_open():
+        return not terminate and release_connection.locked()
+
+    threading.Thread(target=send_events, daemon=True).start()
+    data = b""
+    first_line = True
+    try:
+        send(encode(PROMPT))
+        while is_open():
+            try:
+                chunk = conn.recv(4096)
             except socket.timeout as msg:
-                pass
-    conn.close()
+                continue
+            if not chunk: # connection closed by the client
+                break
+            data += chunk
+            if first_line and b"\n" in data:
+                first_line = False
+                line, _, rest = data.partition(b"\n")
+                if line.strip() == encode(binproto.HELLO):
+                    frames = binproto.binary_table(elevator, request_terminate,
+                                                   end_connection, client, stepper)
+                    data = rest
+                    send(encode("OK %d\r\n" % elevator.levels))
+            if frames is not None:
+                replies, data = binproto.execute_frames(frames, data, is_open)
+                send(replies)
+                continue
+            # several commands may arrive in one packet, answer all in order
+            lines, data = split_lines(data)
+            if lines:
+                send(encode(execute_lines(flist, lines, is_open)))
+    except OSError: # timed out sending or reset by the client
+        pass
+    finally:
+        if release_connection.locked():
+            release_connection.release() # ends send_events()
+        if notifier is not None:
+            notifier.unsubscribe(push)
+        conn.close()
 
 
-def ip_server(port, elevator):
+def ip_server(port, elevator, notifier=None, channel=None, stepper=None):
     """Server which listens on a port."""
     global terminate
     host = "localhost"
@@ -341,153 +149,149 @@ def ip_server(port, elevator):
             s.listen(1)
             conn, addr = s.accept()
             print('Connected by', addr)
-            threading.Thread(target=serve_connection, args=(conn, addr, elevator)).start()
+            threading.Thread(target=serve_connection,
+                             args=(conn, addr, elevator, notifier,
+                                   channel, stepper)).start()
 
         except socket.timeout as msg:
             #print "Timeout:", msg
             pass
 
-def generate_button( name, label, xy):
-    (x,y) = xy
-    font = pygame.font.Font("freesansbold.ttf", BUTTON_FONT_SIZE)
-    # released button
-    released = pygame.Surface((BUTTON_SIZE,BUTTON_SIZE))
-    released.fill((210, 210, 210))
-    pygame.draw.lines(released, (0, 0, 0),True,
-                      [(0, 0), (BUTTON_SIZE-1, 0),
-                       (BUTTON_SIZE-1, BUTTON_SIZE-1), (0, BUTTON_SIZE-1)], 1)
-    pygame.draw.lines(released,(0, 0, 0), True,
-                      [(2, 2), (BUTTON_SIZE-3, 2),
-                       (BUTTON_SIZE-3,BUTTON_SIZE-3), (2, BUTTON_SIZE-3)], 1)
-    text = font.render(label, True,(0, 0, 0))
-    textpos = text.get_rect(centerx=10, centery=10)
-    released.blit(text, textpos)
-    
-    # mouseover-button
-    mouseover = pygame.Surface((BUTTON_SIZE, BUTTON_SIZE))
-    mouseover.fill((150, 150, 150))
-    pygame.draw.lines(mouseover, (0,0,0), True,
-                      [(0, 0), (BUTTON_SIZE-1, 0),
-                       (BUTTON_SIZE-1, BUTTON_SIZE-1), (0,BUTTON_SIZE-1)], 1)
-    pygame.draw.lines(mouseover, (0,0,0), True,
-                      [(2,2), (BUTTON_SIZE-3, 2),
-                       (BUTTON_SIZE-3,BUTTON_SIZE-3),(2,BUTTON_SIZE-3)], 1)
-    text = font.render(label,True,(0,0,0))
-    textpos = text.get_rect(centerx=10,centery=10)
-    mouseover.blit(text, textpos)
-    
-    # pressed button
-    pressed = pygame.Surface((BUTTON_SIZE,BUTTON_SIZE))
-    pressed.fill((190,190,190))
-    pygame.draw.lines(pressed,(0,0,0),True,
-                      [(0,0),(BUTTON_SIZE-1,0),
-                       (BUTTON_SIZE-1,BUTTON_SIZE-1),(0,BUTTON_SIZE-1)], 1)
-    pygame.draw.lines(pressed,(0,0,0),True,
-                      [(1,1),(BUTTON_SIZE-2,1),
-                       (BUTTON_SIZE-2,BUTTON_SIZE-2),(1,BUTTON_SIZE-2)], 1)
-    text = font.render(label,True,(0,0,0))
-    textpos = text.get_rect(centerx=BUTTON_SIZE/2,centery=BUTTON_SIZE/2)
-    pressed.blit(text, textpos)
-    
-    return name,released,mouseover,pressed, (x,y)
-
-def create_buttons(elevator):
-    """Create a list of buttons in the states name,released,
-    mouseover, pressed."""
-    button_list = []
-    # up buttons
-    for i in range(elevator.levels-1):
-        button_list.append( generate_button("up %d"%(elevator.levels-i-1),"^",
-                        (elevator.x_offset + elevator.width + 5,
-                          elevator.y_offset + elevator.height*(i+1) + 2) ) )
-        button_list.append( generate_button("down %d"%(elevator.levels-i),"v",
-                        (elevator.x_offset + elevator.width + 5,
-                         elevator.y_offset + elevator.height*i + 27) ) )
-        button_list.append( generate_button("level %d"%(elevator.levels-i),
-                                            "%d"%(elevator.levels-i),
-                        (225,elevator.y_offset + elevator.height*i + 18) ) )
-    button_list.append( generate_button("level 1","1",
-                    (225,elevator.y_offset + elevator.height*(elevator.levels-1) + 18) ) )
-    return button_list
+def start_server(port, sim, use_asyncio=False, journal=None, stepper=None):
+    """Start the control server for the elevator of sim in the background,
+    return a function stopping it. With a journal.Journal all commands are
+    recorded. With a lockstep.Stepper running sim the connections control
+    its time scale and steps."""
+    notifier = Notifier(sim.elevator)
+    sim.tick_hooks.append(notifier.poll)
+    # commands are applied and the state published between two ticks
+    channel = Channel(sim.elevator, sim.tick)
+    sim.tick_hooks.append(channel)
+    if journal is not None:
+        channel.observers.append(journal.command)
+    if stepper is not None:
+        stepper.watch(channel)
+    if use_asyncio:
+        from aioserver import AsyncElevatorServer  # asyncio is slow to import
+        server = AsyncElevatorServer(sim.elevator, port,
+                                     on_terminate=request_terminate,
+                                     notifier=notifier, channel=channel,
+                                     stepper=stepper)
+        server.start_in_thread()
+        return server.stop
+    threading.Thread(target=ip_server,
+                     args=(port, sim.elevator, notifier, channel,
+                           stepper)).start()
+    return request_terminate
 
-def main(*arg):
-    """this function is called when the program starts.
-       it initializes everything it needs, then runs in
-       a loop until the function returns."""
-    global terminate
-    
-    if len(arg) == 2:
-        levels = int(arg[0])
-        port = int(arg[1])
-    else:
-        port = 23300
-        levels = 10
-    
-    if levels<3:
-        levels = 3 # minimum
-    #Initialize Everything
-    pygame.init()
-    screen = pygame.display.set_mode((250, levels * Elevator.height + 2*Elevator.y_offset))
-    pygame.display.set_caption("Ulno's Elevator Simulator")
-    pygame.mouse.set_visible(1)
+def record(sim, path):
+    """Start journaling sim into path (if given), return the journal."""
+    if not path:
+        return None
+    journal = Journal(path, sim)
+    sim.tick_hooks.append(journal)
+    return journal
 
-    #Create The Background
-    background = create_background(screen)
+def record_telemetry(sim, directory):
+    """Start writing telemetry of sim into directory (if given)."""
+    if not directory:
+        return None
+    from telemetry import TelemetryRecorder  # needs numpy
+    recorder = TelemetryRecorder(directory, sim.elevator)
+    sim.tick_hooks.append(recorder)
+    return recorder
 
-    #Prepare Game Objects
-    clock = pygame.time.Clock()
-    elevator = Elevator( levels )
-    building = Building( levels )
-    allsprites = pygame.sprite.RenderPlain(elevator)
+def start_services(sim, args, stepper=None):
+    """Start the journal, telemetry and control server of sim asked for by
+    the parsed args; return a function stopping them all."""
+    journal = record(sim, args.record)
+    telemetry = record_telemetry(sim, args.telemetry)
+    stop_server = start_server(args.port, sim, args.asyncio, journal, stepper)
 
-    threading.Thread(target=ip_server,args=(port, elevator)).start()
+    def stop():
+        stop_server()
+        for recorder in (journal, telemetry):
+            if recorder:
+                recorder.close()
+    return stop
 
-    while not terminate:
-        clock.tick(60)
+def serve(args):
+    """Simulate without a window, serving the control protocol."""
+    global terminate
+    sim = Simulation(ElevatorCore(max(args.levels, 3)), rate=args.physics_rate)
+    if args.controller:
+        sim.tick_hooks.append(load_controller(args.controller)(sim.elevator))
+    if args.lockstep:
+        scale = 0
+    else:
+        scale = args.time_scale if sim.rate else math.inf
+    stepper = Stepper(sim, scale=scale)
+    stop = start_services(sim, args, stepper)
+    if args.ticks:
+        until = lambda: terminate or sim.tick >= args.ticks
+    else:
+        until = lambda: terminate
+    stepper.run(until)
+    terminate = True
+    stop()
 
-        for event in pygame.event.get():
-            if event.type == QUIT:
-                terminate = True
-            elif event.type == KEYDOWN and event.key == K_ESCAPE:
-                terminate = True
-            elif event.type == MOUSEBUTTONDOWN:
-                #elevator.rect.move_ip(100,100)
-                pass
-        
-        allsprites.update()
+def main(*arg):
+    """this function is called when the program starts.
+    The first argument can name a subcommand: gui (the default) or serve
+    (headless, also --headless) take the arguments below, run (simcore.py),
+    bench (bench.py) and sessions (sessions.py) those of their module.
+    pygame is only imported for gui."""
+    if arg and arg[0] in MODULES:
+        return importlib.import_module(MODULES[arg[0]]).main(*arg[1:])
+    command = "gui"
+    if arg and arg[0] in ("gui", "serve"):
+        command, arg = arg[0], arg[1:]
 
-        #Draw Everything
-        screen.blit(background, (0, 0))
-        allsprites.draw(screen)
-        # behind building
-        screen.blit(building.image,building.rect)
-        # draw statistics
-        draw_statistics(screen, elevator)
-        # buttons
-        mousex,mousey = pygame.mouse.get_pos()
-        mousebutton1 = pygame.mouse.get_pressed()[0]
-        for (name,released,mouseover,pressed,(x,y)) in elevator.buttons:
-            if Rect((x,y),(BUTTON_SIZE,BUTTON_SIZE)).collidepoint(mousex,mousey):
-                if mousebutton1:
-                    elevator.button_states[name] = True
-                    buttonshape = pressed
-                else:
-                    buttonshape = mouseover
-                    elevator.button_states[name] = False
-            else:
-                buttonshape = released
-                elevator.button_states[name] = False
-            screen.blit(buttonshape,(x,y))
-            # check if lamp is on and draw it
-            if elevator.button_lamps[name]:
-                pygame.draw.lines(screen,(255,0,0),True,
-                      [(x-1,y-1),(x+BUTTON_SIZE,y-1),
-                       (x+BUTTON_SIZE,y+BUTTON_SIZE),(x-1,y+BUTTON_SIZE)], 1)
-                
-        # swich screen-buffers
-        pygame.display.flip()
+    parser = argparse.ArgumentParser(prog="elsim.py %s" % command,
+                                     description="Ulno's Elevator Simulator",
+                                     epilog="other subcommands: %s"
+                                            % ", ".join(sorted(MODULES)))
+    parser.add_argument("levels", type=int, nargs="?", default=10)
+    parser.add_argument("port", type=int, nargs="?", default=23300)
+    parser.add_argument("--headless", action="store_true",
+                        help="simulate without a window (same as serve)")
+    parser.add_argument("--physics-rate", "--rate", type=float,
+                        default=TICK_RATE,
+                        help="simulated ticks per second, above 0 (headless: 0 for as fast as possible)")
+    parser.add_argument("--render-rate", type=float, default=TICK_RATE,
+                        help="frames per second, 0 to not render at all")
+    parser.add_argument("--visible-levels", type=int, default=VISIBLE_LEVELS,
+                        help="floors shown in the window, the rest scrolls "
+                             "(wheel, arrows, page up/down; home follows the car)")
+    parser.add_argument("--ticks", type=int, default=0,
+                        help="headless: stop after this many ticks")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="headless: simulate at this multiple of the physics rate")
+    parser.add_argument("--lockstep", action="store_true",
+                        help="headless: only advance on step commands (time scale 0)")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="serve all connections on one asyncio event loop")
+    parser.add_argument("--controller",
+                        help="drive the elevator with an in-process controller: %s or module:Class"
+                             % ", ".join(sorted(CONTROLLERS)))
+    parser.add_argument("--telemetry", metavar="DIRECTORY",
+                        help="write the state of every tick to memory-mapped columns (telemetry.py)")
+    parser.add_argument("--record", metavar="JOURNAL",
+                        help="record all commands and button presses for journal.py replay")
+    args = parser.parse_args(arg)
+    if args.physics_rate < 0 or args.render_rate < 0:
+        parser.error("rates cannot be negative")
+    if not args.time_scale >= 0:
+        parser.error("the time scale cannot be negative")
 
+    if command == "serve" or args.headless:
+        return serve(args)
+    if not args.physics_rate:
+        parser.error("the window needs a --physics-rate above 0")
+    import gui
+    return gui.main(args, start_services, request_terminate,
+                    lambda: terminate)
 
 #this calls the 'main' function when this script is executed
 if __name__ == '__main__':
-    main(*(sys.argv)[1:])
+    sys.exit(main(*(sys.argv)[1:]))
@@ -0,0 +1,199 @@
+"""
+Event-driven (next-event) simulation of an ElevatorCore
+instead of integrating every tick, compute how many ticks pass before the
+next observable change (a level reached, max speed reached, the door fully
+open or closed, an overheat threshold crossed, ...) and jump there in
+closed form; ticks with accelerating or braking cars are stepped normally.
+Moving positions are still summed up tick by tick (a bare float addition)
+so the results match the tick based model exactly.
+"""
+import math
+
+from simcore import Simulation
+
+# names of the observables in observe(), one event per changed observable
+EVENT_NAMES = ("level", "at level", "max speed", "stopped", "car limit",
+               "door open", "door closed", "door fully open",
+               "door fully closed", "motor status", "door motor status",
+               "defect", "door defect")
+
+# margin in ticks kept before a closed-form position crossing, so rounding
+# can never jump past it
+_MARGIN = 2
+
+
+def overheat_status(elevator, counter):
+    """0 ok, 1 overheating, 2 broken."""
+    if counter < elevator.overheat_low:
+        return 0
+    elif counter < elevator.overheat_max:
+        return 1
+    return 2
+
+
+def observe(elevator):
+    """Tuple of the discrete observables of an elevator, see EVENT_NAMES."""
+    door = elevator.door_position
+    return (elevator.current_level(),
+            elevator.save_to_open_door(),
+            abs(elevator.speed) >= elevator.maxspeed,
+            elevator.speed == 0,
+            elevator.position in (0, 1),
+            elevator.is_door_open(),
+            elevator.is_door_closed(),
+            door == 1,
+            door == 0,
+            overheat_status(elevator, elevator.motor_overheat),
+            overheat_status(elevator, elevator.door_motor_overheat),
+            elevator.defect,
+            elevator.door_defect)
+
+
+def changed_events(before, after):
+    """Names of the observables that differ between two observe() tuples."""
+    return [name for name, b, a in zip(EVENT_NAMES, before, after) if b != a]
+
+
+def _cooling_ticks(elevator, counter):
+    """Ticks a cooling counter keeps its status."""
+    if counter >= elevator.overheat_max:
+        return counter - elevator.overheat_max
+    elif counter >= elevator.overheat_low:
+        return counter - elevator.overheat_low
+    return math.inf
+
+
+def _heating_ticks(elevator, counter):
+    """Ticks a heating counter keeps its status."""
+    if counter < elevator.overheat_low:
+        return elevator.overheat_low - counter - 1
+    elif counter < elevator.overheat_max:
+        return elevator.overheat_max - counter - 1
+    return math.inf
+
+
+def _crossing_ticks(x, dx, boundaries):
+    """Ticks x can advance by dx without reaching one of boundaries."""
+    if dx > 0:
+        ahead = [b - x for b in boundaries if b > x]
+    else:
+        ahead = [x - b for b in boundaries if b < x]
+    if not ahead:
+        return 0
+    return max(0, int(min(ahead) / abs(dx)) - _MARGIN)
+
+
+def _component_ticks(elevator, position, delta, counter, boundaries, scale):
+    """Quiet ticks of a motor moving position by delta per tick."""
+    if delta == 0:
+        return _cooling_ticks(elevator, counter)
+    if (delta > 0 and position == 1) or (delta < 0 and position == 0):
+        return _heating_ticks(elevator, counter)
+    if position in (0, 1):
+        return 0  # leaving a limit
+    moving = _crossing_ticks(position*scale, delta*scale, boundaries)
+    return min(moving, _cooling_ticks(elevator, counter))
+
+
+def _level_boundaries(x, levels):
+    """Positions (in level units) around x where a car observable changes:
+    level changes at n+0.5, save-to-open window is [n, n+0.04)."""
+    n = int(x)
+    return [b for m in (n-1, n, n+1)
+            for b in (m, m+0.04, m+0.5) if 0 <= b <= levels-1]
+
+
+class EventSimulation(Simulation):
+    """Simulation which skips ticks in which nothing observable happens.
+    Works on a headless ElevatorCore (sprites are not redrawn). A tick hook
+    with a quiet_ticks(sim) method is skipped as long as that says, other
+    hooks force stepping every tick."""
+
+    def __init__(self, elevator, rate=None):
+        Simulation.__init__(self, elevator, rate)
+
+    def speed_is_steady(self):
+        e = self.elevator
+        if e.direction == 1:
+            return e.speed >= e.maxspeed
+        elif e.direction == -1:
+            return e.speed <= -e.maxspeed
+        return e.speed == 0
+
+    def quiet_ticks(self):
+        """Number of ticks which can be jumped in closed form without any
+        observable change, math.inf if the state never changes again."""
+        e = self.elevator
+        if not self.speed_is_steady():
+            return 0
+        quiet = math.inf
+        if not e.defect:
+            x = e.position*(e.levels-1)
+            quiet = _component_ticks(e, e.position, e.speed/e.levels,
+                                     e.motor_overheat,
+                                     _level_boundaries(x, e.levels),
+                                     e.levels-1)
+        if not e.door_defect and quiet:
+            quiet = min(quiet, _component_ticks(
+                e, e.door_position, e.door_motor*e.door_step,
+                e.door_motor_overheat, (0, 0.1, 0.9, 1), 1))
+        # tick hooks run every tick unless they tell how long they sleep
+        for hook in self.tick_hooks:
+            if not quiet:
+                break
+            hook_quiet = getattr(hook, "quiet_ticks", None)
+            quiet = min(quiet, hook_quiet(self) if hook_quiet else 0)
+        return quiet
+
+    def _jump(self, ticks):
+        """Advance ticks quiet ticks in closed form."""
+        e = self.elevator
+        if not e.defect:
+            e.position, e.motor_overheat = self._jump_motor(
+                e.position, e.speed/e.levels, e.motor_overheat, ticks)
+        if not e.door_defect:
+            e.door_position, e.door_motor_overheat = self._jump_motor(
+                e.door_position, e.door_motor*e.door_step,
+                e.door_motor_overheat, ticks)
+        self.tick += ticks
+
+    @staticmethod
+    def _jump_motor(position, delta, counter, ticks):
+        if delta == 0:
+            return position, max(0, counter - ticks)
+        if (delta > 0 and position == 1) or (delta < 0 and position == 0):
+            return position, counter + ticks
+        # repeated addition keeps the rounding of the tick based model
+        for _ in range(ticks):
+            position += delta
+        return position, max(0, counter - ticks)
+
+    def run(self, ticks):
+        """Advance exactly ticks ticks, skipping quiet stretches."""
+        end = self.tick + ticks
+        while self.tick < end:
+            quiet = min(self.quiet_ticks(), end - self.tick)
+            if quiet:
+                self._jump(quiet)
+            else:
+                self.step()
+        return self.tick
+
+    def next_event(self, limit=None):
+        """Advance to the tick of the next observable change and return
+        the names of the events, or [] if limit ticks passed without one
+        (or nothing will ever change and no limit is given)."""
+        end = math.inf if limit is None else self.tick + limit
+        before = observe(self.elevator)
+        while self.tick < end:
+            quiet = min(self.quiet_ticks(), end - self.tick)
+            if quiet == math.inf:
+                return []
+            if quiet:
+                self._jump(quiet)
+                continue
+            self.step()
+            events = changed_events(before, observe(self.elevator))
+            if events:
+                return events
+        return []
@@ -0,0 +1,447 @@
+"""
+Window of ELSIM
+the elevator, its building and buttons drawn with pygame; only this module
+imports pygame, so the headless simulator and the servers start without it
+"""
+import time
+import pygame
+from pygame.locals import *
+from simcore import ElevatorCore, Simulation, FixedStep
+from controllers import load_controller
+
+if not pygame.font:
+    print('Warning, fonts disabled')
+
+BUTTON_SIZE = 21
+BUTTON_FONT_SIZE = 13
+
+class ElevatorSprite(pygame.sprite.Sprite):
+    """The sprite of an ElevatorCore with the buttons of its building,
+    only created when the elevator is rendered."""
+    width = 40
+    height = 50
+    color = 200, 0, 0
+    x_offset, y_offset = 5, 5
+
+    def position_to_coordinate(self, position):
+        return (self.levels - 1) * self.height * (1 - position) + self.y_offset
+    def _draw_door(self):
+        self.image.fill((0, 0, 0))
+        door_width = (1 - self.elevator.door_position) * (self.width/2 - 5)
+        pygame.draw.rect(self.image, self.color,
+                         (0, 0, door_width + 6, self.height))
+        pygame.draw.rect(self.image, self.color,
+                         (self.width-door_width-4, 0, door_width+4, self.height))
+
+    def __init__(self, elevator):
+        pygame.sprite.Sprite.__init__(self)  #call Sprite intializer
+        self.elevator = elevator
+        self.levels = elevator.levels
+        self.image = pygame.Surface((self.width, self.height))
+        self._draw_door()
+        self._drawn_door = elevator.door_position
+        self.rect = pygame.Rect(
+                (self.x_offset, self.position_to_coordinate(elevator.position)),
+                (self.width, self.height))
+        self.buttons = create_buttons(self)
+
+    def redraw(self):
+        """Bring the sprite up to date with the simulated state,
+        return the screen areas which changed."""
+        dirty = []
+        elevator = self.elevator
+        if elevator.door_position != self._drawn_door:
+            self._draw_door()
+            self._drawn_door = elevator.door_position
+            dirty.append(self.rect.copy())
+        top = int(self.position_to_coordinate(elevator.position))
+        if top != self.rect.top:
+            dirty.append(self.rect.copy())
+            self.rect.top = top
+            dirty.append(self.rect.copy())
+        return dirty
+
+def create_background(screen):
+    background = pygame.Surface(screen.get_size())
+    background = background.convert()
+    background.fill((250, 250, 250))
+    return background
+
+
+class Viewport:
+    """The part of the building shown in a window of rows floors, as the
+    world y coordinate of its top; follows the car until scrolled by hand.
+    moved is set when everything has to be drawn again."""
+    step = ElevatorSprite.height  # pixels per line scrolled
+
+    def __init__(self, levels, rows):
+        self.levels = levels
+        self.rows = min(rows, levels)
+        self.height = self.rows*ElevatorSprite.height + 2*ElevatorSprite.y_offset
+        self.limit = (levels - self.rows) * ElevatorSprite.height  # max top
+        self.top = self.limit  # start at the ground floor
+        self.follow = True
+        self.moved = True
+
+    def scroll_to(self, top):
+        top = max(0, min(self.limit, int(top)))
+        if top != self.top:
+            self.top = top
+            self.moved = True
+
+    def scroll(self, pixels):
+        """Scroll by hand, which stops following the car."""
+        self.follow = False
+        self.scroll_to(self.top + pixels)
+
+    def track(self, car):
+        """Center the car when following it and it left the middle half."""
+        if not self.follow:
+            return
+        middle = car.rect.centery - self.top - self.height/2
+        if abs(middle) > self.height/4:
+            self.scroll_to(self.top + middle)
+
+    def visible_rows(self):
+        """The first and the last floor row (0 is the top floor) in view."""
+        height, offset = ElevatorSprite.height, ElevatorSprite.y_offset
+        return (max(0, (self.top - offset - 3) // height),
+                min(self.levels - 1, (self.top + self.height - offset) // height))
+
+    def visible_buttons(self, car):
+        """The buttons of the rows in view (and a few next to them)."""
+        first, last = self.visible_rows()
+        return car.buttons[max(0, 3*first - 3):3*last + 3]
+
+    def to_screen(self, rect):
+        return rect.move(0, -self.top)
+
+
+class Building:
+    """The shaft, one floor drawn once and repeated for the rows in view."""
+
+    def __init__(self, levels):
+        self.levels = levels
+        width, height = ElevatorSprite.width, ElevatorSprite.height
+        self.floor = pygame.Surface((width + 3, height + 3))
+        self.floor.set_colorkey((0, 0, 0))
+        pygame.draw.lines(self.floor, (0, 0, 255), True,
+                          [(1, 1), (width+1, 1), (width+1, height+1),
+                           (1, height+1)], 3)
+
+    def draw(self, screen, view, area=None):
+        """Draw the floors in view in front of the car, clipped to area."""
+        screen.set_clip(area)
+        x = ElevatorSprite.x_offset - 1
+        y = ElevatorSprite.y_offset - 1 - view.top
+        first, last = view.visible_rows()
+        for row in range(first, last + 1):
+            screen.blit(self.floor, (x, y + row*ElevatorSprite.height))
+        screen.set_clip(None)
+
+_fonts = {}
+
+def get_font(size=BUTTON_FONT_SIZE):
+    """Fonts are loaded once and shared."""
+    font = _fonts.get(size)
+    if font is None:
+        font = _fonts[size] = pygame.font.Font("freesansbold.ttf", size)
+    return font
+
+def statistics_lines(elevator):
+    return ["level %02d"       % elevator.current_level(),
+            "door open: %s"    %(elevator.is_door_open() and "yes" or "no"),
+            "door closed: %s"  %(elevator.is_door_closed() and "yes" or "no"),
+            "save to open: %s" %(elevator.save_to_open_door() and "yes" or "no"),
+            "motor status: %s" % elevator.motor_status(),
+            "door motor: %s"   % elevator.door_motor_status(),
+            "speed: %s"        %(elevator.speed*1000),
+            "door defect: %s"  %(elevator.is_door_defect() and "yes" or "no"),
+            "motor defect: %s" %(elevator.is_defect() and "yes" or "no"),
+            ]
+
+class StatisticsPanel:
+    """The statistics text, a line is only rendered again when it changed."""
+    left = 90
+
+    def __init__(self, background, top=ElevatorSprite.y_offset):
+        self.background = background
+        self.top = top
+        self.lines = []  # (text, rect) of every drawn line
+
+    def draw(self, screen, elevator):
+        """Draw the changed lines, return the dirty rectangles."""
+        font = get_font()
+        dirty = []
+        y = self.top
+        for i, output in enumerate(statistics_lines(elevator)):
+            if i < len(self.lines) and self.lines[i][0] == output:
+                y += 2 + self.lines[i][1].height
+                continue
+            text = font.render(output, 1, (10, 10, 10))
+            textpos = text.get_rect(top=y,left=self.left)
+            if i < len(self.lines):
+                old = self.lines[i][1]
+                screen.blit(self.background, old, old)
+                dirty.append(old.union(textpos))
+                self.lines[i] = (output, textpos)
+            else:
+                dirty.append(textpos)
+                self.lines.append((output, textpos))
+            screen.blit(text, textpos)
+            y += 2 + textpos.height
+        return dirty
+
+def mouse_over_button(car, view):
+    """Return the name of the button under the mouse pointer, or None."""
+    mousex,mousey = pygame.mouse.get_pos()
+    mousey += view.top
+    for button in view.visible_buttons(car):
+        if button.rect.collidepoint(mousex,mousey):
+            return button.name
+    return None
+
+def read_buttons(car, view):
+    """A button is pressed while the mouse button is held down over it."""
+    if pygame.mouse.get_pressed()[0]:
+        hovered = mouse_over_button(car, view)
+    else:
+        hovered = None
+    states = car.elevator.button_states
+    for name in states.on():
+        if name != hovered:
+            states[name] = False
+    if hovered is not None and not states[hovered]:
+        states[hovered] = True
+
+def scroll(view, event):
+    """Scroll view for a mouse wheel or key event, return whether it was
+    one: wheel, arrow keys and page up/down scroll, home follows the car."""
+    if event.type == MOUSEWHEEL:
+        view.scroll(-event.y * view.step)
+    elif event.type != KEYDOWN:
+        return False
+    elif event.key == K_UP:
+        view.scroll(-view.step)
+    elif event.key == K_DOWN:
+        view.scroll(view.step)
+    elif event.key == K_PAGEUP:
+        view.scroll(-view.height // 2)
+    elif event.key == K_PAGEDOWN:
+        view.scroll(view.height // 2)
+    elif event.key == K_HOME:
+        view.follow = True
+    else:
+        return False
+    return True
+
+class ButtonPanel:
+    """The buttons and their lamps, a button is only drawn again when its
+    shape or lamp changed."""
+
+    def __init__(self, background):
+        self.background = background
+        self.drawn = {}  # name -> (shape, lamp) as drawn
+
+    def draw(self, screen, car, view):
+        """Draw the changed buttons in view of the ElevatorSprite car,
+        return the dirty rectangles."""
+        hovered = mouse_over_button(car, view)
+        elevator = car.elevator
+        dirty = []
+        for button in view.visible_buttons(car):
+            name, x, y = button.name, button.x, button.y - view.top
+            if elevator.button_states[name]:
+                shape = 2 # pressed
+            elif name == hovered:
+                shape = 1 # mouseover
+            else:
+                shape = 0 # released
+            lamp = elevator.button_lamps[name]
+            if self.drawn.get(name) == (shape, lamp):
+                continue
+            self.drawn[name] = (shape, lamp)
+            buttonshape = button.shapes()[shape]
+            # area including the lamp frame around the button
+            area = Rect(x-1, y-1, BUTTON_SIZE+2, BUTTON_SIZE+2)
+            screen.blit(self.background, area, area)
+            screen.blit(buttonshape,(x,y))
+            # check if lamp is on and draw it
+            if lamp:
+                pygame.draw.lines(screen,(255,0,0),True,
+                      [(x-1,y-1),(x+BUTTON_SIZE,y-1),
+                       (x+BUTTON_SIZE,y+BUTTON_SIZE),(x-1,y+BUTTON_SIZE)], 1)
+            dirty.append(area)
+        return dirty
+
+def draw_car(screen, background, car, building, view):
+    """Draw the car where it changed, return the dirty rectangles."""
+    dirty = car.redraw()
+    if dirty:
+        area = view.to_screen(dirty[0].unionall(dirty[1:]))
+        area = area.clip(screen.get_rect())
+        if not area:
+            return []  # out of view
+        screen.blit(background, area, area)
+        screen.blit(car.image, view.to_screen(car.rect))
+        # the building is in front of the car
+        building.draw(screen, view, area)
+        dirty = [area]
+    return dirty
+
+def draw_view(screen, background, car, building, statistics, buttons, view):
+    """Draw everything again (at the start and after scrolling), return the
+    dirty rectangles."""
+    screen.blit(background, (0, 0))
+    car.redraw()
+    screen.blit(car.image, view.to_screen(car.rect))
+    building.draw(screen, view)
+    statistics.lines = []
+    buttons.drawn = {}
+    statistics.draw(screen, car.elevator)
+    buttons.draw(screen, car, view)
+    view.moved = False
+    return [screen.get_rect()]
+
+def _button_frame(color, inner):
+    """A button without label; inner is the offset of the inner frame."""
+    frame = pygame.Surface((BUTTON_SIZE,BUTTON_SIZE))
+    frame.fill(color)
+    pygame.draw.lines(frame, (0, 0, 0),True,
+                      [(0, 0), (BUTTON_SIZE-1, 0),
+                       (BUTTON_SIZE-1, BUTTON_SIZE-1), (0, BUTTON_SIZE-1)], 1)
+    pygame.draw.lines(frame,(0, 0, 0), True,
+                      [(inner, inner), (BUTTON_SIZE-1-inner, inner),
+                       (BUTTON_SIZE-1-inner,BUTTON_SIZE-1-inner),
+                       (inner, BUTTON_SIZE-1-inner)], 1)
+    return frame
+
+class ButtonAtlas:
+    """The released, mouseover and pressed surfaces of the buttons.
+    The frames are drawn once, a label is rendered onto them the first time
+    a button with this label is drawn and then shared by all buttons with
+    the same label (all up and all down buttons share theirs)."""
+
+    def __init__(self):
+        self.frames = None
+        self.shapes = {}  # label -> (released, mouseover, pressed)
+
+    def get(self, label):
+        shapes = self.shapes.get(label)
+        if shapes is None:
+            if self.frames is None:
+                self.frames = (_button_frame((210, 210, 210), 2),  # released
+                               _button_frame((150, 150, 150), 2),  # mouseover
+                               _button_frame((190, 190, 190), 1))  # pressed
+            text = get_font().render(label, True, (0, 0, 0))
+            shapes = []
+            for frame, center in zip(self.frames, (10, 10, BUTTON_SIZE/2)):
+                shape = frame.copy()
+                shape.blit(text, text.get_rect(centerx=center, centery=center))
+                shapes.append(shape)
+            shapes = self.shapes[label] = tuple(shapes)
+        return shapes
+
+button_atlas = ButtonAtlas()
+
+class Button:
+    """A button at x, y; its surfaces come from the shared button_atlas."""
+    __slots__ = ("name", "label", "x", "y", "rect")
+
+    def __init__(self, name, label, xy):
+        self.name = name
+        self.label = label
+        (self.x, self.y) = xy
+        self.rect = Rect(xy, (BUTTON_SIZE, BUTTON_SIZE))
+
+    def shapes(self):
+        """released, mouseover, pressed surface"""
+        return button_atlas.get(self.label)
+
+def create_buttons(car):
+    """Create the list of buttons of all levels next to the ElevatorSprite car."""
+    button_list = []
+    # up buttons
+    for i in range(car.levels-1):
+        button_list.append( Button("up %d"%(car.levels-i-1),"^",
+                        (car.x_offset + car.width + 5,
+                          car.y_offset + car.height*(i+1) + 2) ) )
+        button_list.append( Button("down %d"%(car.levels-i),"v",
+                        (car.x_offset + car.width + 5,
+                         car.y_offset + car.height*i + 27) ) )
+        button_list.append( Button("level %d"%(car.levels-i),
+                                   "%d"%(car.levels-i),
+                        (225,car.y_offset + car.height*i + 18) ) )
+    button_list.append( Button("level 1","1",
+                    (225,car.y_offset + car.height*(car.levels-1) + 18) ) )
+    return button_list
+
+def main(args, start_services, request_terminate, terminated):
+    """Show the simulation in a window, with the control server running;
+    args are the parsed arguments of elsim.main(), start_services is
+    elsim.start_services(), request_terminate() stops the simulator and
+    terminated() tells whether it was stopped (also by a client)."""
+    levels = max(args.levels, 3) # minimum
+
+    #Initialize only what is drawn: no mixer, joystick, ...
+    pygame.display.init()
+    pygame.font.init()
+    view = Viewport(levels, max(args.visible_levels, 1))
+    screen = pygame.display.set_mode((250, view.height))
+    pygame.display.set_caption("Ulno's Elevator Simulator")
+    pygame.mouse.set_visible(1)
+
+    #Create The Background
+    background = create_background(screen)
+
+    #Prepare Game Objects
+    elevator = ElevatorCore( levels )
+    car = ElevatorSprite( elevator )
+    building = Building( levels )
+    sim = Simulation(elevator)
+    if args.controller:
+        sim.tick_hooks.append(load_controller(args.controller)(elevator))
+    stop_services = start_services(sim, args)
+
+    statistics = StatisticsPanel(background)
+    buttons = ButtonPanel(background)
+    view.track(car)
+    draw_view(screen, background, car, building, statistics, buttons, view)
+    pygame.display.flip()
+
+    physics = FixedStep(args.physics_rate)
+    render = FixedStep(args.render_rate) if args.render_rate else None
+
+    while not terminated():
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                request_terminate()
+            elif event.type == KEYDOWN and event.key == K_ESCAPE:
+                request_terminate()
+            elif scroll(view, event):
+                pass
+            elif event.type == MOUSEBUTTONDOWN:
+                #elevator.rect.move_ip(100,100)
+                pass
+
+        read_buttons(car, view)
+        for _ in range(physics.due()):
+            sim.step()
+
+        if render and render.due():
+            # only the changed parts of the screen are drawn and updated
+            view.track(car)
+            if view.moved:
+                dirty = draw_view(screen, background, car, building,
+                                  statistics, buttons, view)
+            else:
+                dirty = draw_car(screen, background, car, building, view)
+                dirty += statistics.draw(screen, elevator)
+                dirty += buttons.draw(screen, car, view)
+            pygame.display.update(dirty)
+
+        wait = physics.wait_time()
+        if render:
+            wait = min(wait, render.wait_time())
+        time.sleep(wait)
+    stop_services()
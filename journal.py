@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""
+Command journal of ELSIM
+records every protocol command and every button change, stamped with the
+tick, in a compact binary file; replay() re-runs such a journal on the
+headless core as fast as possible and checks the recorded states
+"""
+import sys
+import time
+import struct
+import argparse
+import threading
+
+from simcore import ElevatorCore, Simulation, TICK_RATE, Buttons, button_names
+from protocol import command_table, execute, COMMANDS
+
+MAGIC = b"ELSJ"
+VERSION = 3
+# magic, version, levels, maxspeed, speedstep, door_step, overheat_low/max
+HEADER = struct.Struct("<4sHHdddii")
+RECORD = struct.Struct("<QBH")  # tick, kind, value
+LENGTH = struct.Struct("<H")
+# position, speed, direction, door position, door motor, defect,
+# door defect, motor overheat, door motor overheat; then the pressed
+# buttons and the lit lamps as bit masks in button_names() order
+STATE = struct.Struct("<ddbdb??ii")
+
+# record kinds; a command line without argument is defined once and then
+# referred to by id, lamp commands carry the button index or the mask and
+# any other line is written out (LINE) every time
+DEFINE, COMMAND, PRESS, RELEASE, STATE_CHECK, LAMP_ON, LAMP_OFF, \
+    LAMPS_MASK, LINE = range(9)
+KIND_NAMES = ("define", "command", "press", "release", "state", "lamp on",
+              "lamp off", "lamps mask", "line")
+MAX_LINES = 1 << 16  # command ids fit the value field
+INTERNED = set(COMMANDS) | {"lamps off"}  # the lines defined once
+
+
+def mask_size(levels):
+    return (len(button_names(levels))+7)//8
+
+def pack_state(elevator):
+    e = elevator
+    return STATE.pack(e.position, e.speed, e.direction, e.door_position,
+                      e.door_motor, e.defect, e.door_defect,
+                      e.motor_overheat, e.door_motor_overheat) + \
+        e.button_states.to_bytes() + e.button_lamps.to_bytes()
+
+
+def unpack_state(data, levels):
+    """Return the state as a dict of ElevatorCore attributes."""
+    fields = STATE.unpack_from(data)
+    state = dict(zip(("position", "speed", "direction", "door_position",
+                      "door_motor", "defect", "door_defect",
+                      "motor_overheat", "door_motor_overheat"), fields))
+    size = mask_size(levels)
+    state["button_states"] = Buttons(levels, int.from_bytes(
+        data[STATE.size:STATE.size+size], "little"))
+    state["button_lamps"] = Buttons(levels, int.from_bytes(
+        data[STATE.size+size:], "little"))
+    return state
+
+
+class ButtonStates(Buttons):
+    """button_states which tell the journal about every change."""
+    __slots__ = ("journal",)
+
+    def __init__(self, journal, states):
+        Buttons.__init__(self, journal.sim.elevator.levels, states.bits)
+        self.journal = journal
+
+    def __setitem__(self, name, pressed):
+        if Buttons.__getitem__(self, name) != bool(pressed):
+            self.journal.button(name, pressed)
+        Buttons.__setitem__(self, name, pressed)
+
+    def set_mask(self, bits):
+        old = self.bits
+        Buttons.set_mask(self, bits)
+        changed = old ^ self.bits
+        for i, name in enumerate(self.names):
+            if changed >> i & 1:
+                self.journal.button(name, self.bits >> i & 1)
+
+    def clear(self):
+        self.set_mask(0)
+
+
+class Journal:
+    """Record the commands and button changes of the elevator of sim into
+    the file path. Add command() to the observers of the channel.Channel
+    of the connections and the journal as a tick hook; every checkpoint
+    ticks it also writes the state, so replay can check it."""
+    checkpoint = TICK_RATE*60
+
+    def __init__(self, path, sim):
+        self.sim = sim
+        self.names = button_names(sim.elevator.levels)
+        self.indices = {name: i for i, name in enumerate(self.names)}
+        self.lines = {}  # command line -> id
+        self.lock = threading.Lock()  # records come from several threads
+        self.file = open(path, "wb")
+        e = sim.elevator
+        self.file.write(HEADER.pack(MAGIC, VERSION, e.levels, e.maxspeed,
+                                    e.speedstep, e.door_step,
+                                    e.overheat_low, e.overheat_max))
+        self.write_state()
+        e.button_states = ButtonStates(self, e.button_states)
+
+    def _record(self, kind, value, data=b""):
+        self.file.write(RECORD.pack(self.sim.tick, kind, value) + data)
+
+    def write_state(self):
+        with self.lock:
+            self._record(STATE_CHECK, 0,
+                         pack_state(self.sim.elevator))
+            self.file.flush()
+
+    def button(self, name, pressed):
+        with self.lock:
+            self._record(PRESS if pressed else RELEASE, self.indices[name])
+
+    def command(self, line):
+        """Record a command line, to be called right before applying it."""
+        with self.lock:
+            command_id = self.lines.get(line)
+            if command_id is not None:
+                self._record(COMMAND, command_id)
+                return
+            words = line.split(" ")
+            if words[0] == "lamp" and words[-1] in ("on", "off") and \
+               " ".join(words[1:-1]) in self.indices:
+                self._record(LAMP_ON if words[-1] == "on" else LAMP_OFF,
+                             self.indices[" ".join(words[1:-1])])
+            elif words[:2] == ["lamps", "mask"] and len(words) == 3:
+                mask = int(words[2], 16)
+                self._record(LAMPS_MASK, 0, mask.to_bytes(
+                    mask_size(self.sim.elevator.levels), "little"))
+            elif line in INTERNED and len(self.lines) < MAX_LINES:
+                command_id = self.lines[line] = len(self.lines)
+                self._record(DEFINE, command_id, self._text(line))
+                self._record(COMMAND, command_id)
+            else:
+                self._record(LINE, 0, self._text(line))
+
+    @staticmethod
+    def _text(line):
+        data = line.encode("utf-8")
+        return LENGTH.pack(len(data)) + data
+
+    def __call__(self, sim):
+        if sim.tick % self.checkpoint == 0:
+            self.write_state()
+
+    def close(self):
+        self.write_state()
+        self.file.close()
+
+
+def read(path):
+    """Yield the header fields, then (tick, kind, value) for every record;
+    value is the command line (kind COMMAND for every kind of command
+    record), the button name or the state dict."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, levels, *physics = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("%s is not an elevator journal" % path)
+    yield (levels, *physics)
+    names = button_names(levels)
+    size = mask_size(levels)
+    state_size = STATE.size + 2*size
+    lines = {}
+    offset = HEADER.size
+    while offset < len(data):
+        if len(data) - offset < RECORD.size:
+            break  # cut off while writing
+        tick, kind, value = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if kind in (DEFINE, LINE):
+            length, = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            line = data[offset:offset+length].decode("utf-8")
+            offset += length
+            if kind == DEFINE:
+                lines[value] = line
+            else:
+                yield tick, COMMAND, line
+        elif kind == COMMAND:
+            yield tick, kind, lines[value]
+        elif kind in (LAMP_ON, LAMP_OFF):
+            yield tick, COMMAND, "lamp %s %s" % (
+                names[value], "on" if kind == LAMP_ON else "off")
+        elif kind == LAMPS_MASK:
+            if len(data) - offset < size:
+                break
+            mask = int.from_bytes(data[offset:offset+size], "little")
+            offset += size
+            yield tick, COMMAND, "lamps mask %x" % mask
+        elif kind in (PRESS, RELEASE):
+            yield tick, kind, names[value]
+        elif kind == STATE_CHECK:
+            if len(data) - offset < state_size:
+                break
+            yield tick, kind, unpack_state(data[offset:offset+state_size],
+                                           levels)
+            offset += state_size
+        else:
+            raise ValueError("bad record kind %d at offset %d"
+                             % (kind, offset - RECORD.size))
+
+
+def differences(elevator, state):
+    """The (attribute, recorded, replayed) where elevator differs from state."""
+    return [(name, value, getattr(elevator, name))
+            for name, value in state.items()
+            if getattr(elevator, name) != value]
+
+
+def replay(path, controller=None, event_driven=True):
+    """Re-run the journal at path on a headless core, with the in-process
+    controller if the recording had one. Return the simulation and a list
+    of (tick, attribute, recorded, replayed) for every state mismatch."""
+    records = read(path)
+    levels, maxspeed, speedstep, door_step, overheat_low, overheat_max = \
+        next(records)
+    elevator = ElevatorCore(levels)
+    elevator.maxspeed, elevator.speedstep, elevator.door_step = \
+        maxspeed, speedstep, door_step
+    elevator.overheat_low, elevator.overheat_max = overheat_low, overheat_max
+    if event_driven:
+        from eventsim import EventSimulation as simulation_class
+    else:
+        simulation_class = Simulation
+    sim = simulation_class(elevator, rate=None)
+    if controller:
+        from controllers import load_controller
+        sim.tick_hooks.append(load_controller(controller)(elevator))
+    flist = command_table(elevator, lambda: None, lambda: None)
+    mismatches = []
+    started = False
+    for tick, kind, value in records:
+        if not started:
+            # the first state is where the recording started
+            for name, field in value.items():
+                setattr(elevator, name, field)
+            sim.tick = tick
+            started = True
+            continue
+        if tick > sim.tick:
+            sim.run(tick - sim.tick)
+        if kind == COMMAND:
+            execute(flist, value)
+        elif kind in (PRESS, RELEASE):
+            elevator.button_states[value] = kind == PRESS
+        elif kind == STATE_CHECK:
+            mismatches.extend((tick,) + d for d in differences(elevator, value))
+    return sim, mismatches
+
+
+def main(*arg):
+    """Replay or dump an elevator journal recorded with --record."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("action", choices=("replay", "dump"))
+    parser.add_argument("journal")
+    parser.add_argument("--controller",
+                        help="the in-process controller used when recording")
+    parser.add_argument("--tick-by-tick", action="store_true",
+                        help="do not skip quiet ticks")
+    args = parser.parse_args(arg)
+    if args.action == "dump":
+        records = read(args.journal)
+        print("levels %d, maxspeed %s, speedstep %s, door step %s, "
+              "overheat %d/%d" % next(records))
+        for tick, kind, value in records:
+            print("%d %s %s" % (tick, KIND_NAMES[kind], value))
+        return
+    start = time.perf_counter()
+    sim, mismatches = replay(args.journal, args.controller,
+                             not args.tick_by_tick)
+    elapsed = time.perf_counter() - start
+    for tick, name, recorded, replayed in mismatches:
+        print("tick %d: %s is %s, recorded %s"
+              % (tick, name, replayed, recorded))
+    print("replayed %d ticks in %.2f s, level %02d, motor status: %s, %s"
+          % (sim.tick, elapsed, sim.elevator.current_level(),
+             sim.elevator.motor_status(),
+             mismatches and "STATE DIFFERS" or "state matches"))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*(sys.argv)[1:]))
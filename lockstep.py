@@ -0,0 +1,139 @@
+"""
+Lockstep mode of ELSIM
+a Stepper runs the simulation thread either free at a multiple of real time
+or, at time scale 0, only on the step requests of the connections, so a
+controller sees the same ticks however slow or fast it is
+"""
+import math
+import time
+import threading
+import collections
+
+from simcore import FixedStep, TICK_RATE
+from notify import Notifier, EVENT_PREFIX
+
+
+class Stepper:
+    """Drive sim at scale times its rate (math.inf: as fast as possible,
+    0: lockstep). channel is the channel.Channel of the connections; its
+    commands are also applied while the simulation waits for a step."""
+    limit = TICK_RATE*3600  # most ticks of one step request
+    poll = 0.1  # seconds between checks of until() while paused
+    batch = 100  # ticks between checks for requests at full speed
+
+    def __init__(self, sim, channel=None, scale=1.0):
+        self.sim = sim
+        self.rate = sim.rate or TICK_RATE  # ticks per second at scale 1
+        self.channel = None
+        self.scale = self.paced(scale)
+        self.requests = collections.deque()  # [function, done, result]
+        self.wakeup = threading.Condition()
+        self.stopped = False
+        self.observer = Notifier(sim.elevator)  # only to diff states
+        if channel is not None:
+            self.watch(channel)
+
+    def watch(self, channel):
+        self.channel = channel
+        channel.on_submit = self.wake
+
+    def wake(self):
+        with self.wakeup:
+            self.wakeup.notify()
+
+    def call(self, f):
+        """Call f in the simulation thread between two ticks, wait for it
+        and return its result (None once the simulation stopped)."""
+        request = [f, threading.Event(), None]
+        with self.wakeup:
+            if self.stopped:
+                return None
+            self.requests.append(request)
+            self.wakeup.notify()
+        request[1].wait()
+        return request[2]
+
+    def paced(self, scale):
+        """scale, or math.inf if rate*scale ticks per second are too many
+        to pace (FixedStep needs a period above 0)."""
+        if math.isinf(self.rate*scale):
+            return math.inf
+        return scale
+
+    def set_scale(self, scale):
+        """Change the time scale; when it returns, the simulation runs
+        (or stands still) at the new scale."""
+        scale = self.paced(scale)
+        self.call(lambda: setattr(self, "scale", scale))
+
+    def step(self, ticks=1, kinds=None):
+        """Advance ticks ticks, or with kinds until an event of one of those
+        kinds (notify.EVENT_KINDS) happened, at most limit ticks; called by
+        a connection, waits until done. Return the tick and the events (as
+        the lines of notify without "event ")."""
+        events = self.call(lambda: self._advance(ticks, kinds))
+        return self.sim.tick, events or []
+
+    def _advance(self, ticks, kinds):
+        sim = self.sim
+        if kinds is None:
+            sim.run(ticks)
+            return []
+        before = self.observer.state()
+        for _ in range(self.limit):
+            sim.step()
+            after = self.observer.state()
+            events = [text[len(EVENT_PREFIX):] for kind, text
+                      in self.observer.changes(before, after)
+                      if kind in kinds]
+            if events:
+                return events
+            before = after
+        return []
+
+    def _pending(self):
+        return self.channel is not None and self.channel.queue
+
+    def run(self, until):
+        """Run in the simulation thread until until() returns true."""
+        sim = self.sim
+        physics = scale = None
+        try:
+            while not until():
+                if self.requests:
+                    # commands queued before the request come first
+                    if self._pending():
+                        self.channel(sim)
+                    f, done, _ = request = self.requests.popleft()
+                    request[2] = f()
+                    done.set()
+                elif self.scale == 0:
+                    scale = None  # pace anew when running again
+                    with self.wakeup:
+                        if not (self.requests or self._pending()) and \
+                           self.scale == 0:
+                            self.wakeup.wait(self.poll)
+                    if self._pending():
+                        self.channel(sim)  # apply, publish the same tick
+                elif self.scale == math.inf:
+                    scale = None
+                    for _ in range(self.batch):
+                        if until():
+                            break
+                        sim.step()
+                else:
+                    if self.scale != scale:
+                        scale = self.scale
+                        physics = FixedStep(self.rate*scale)
+                    for _ in range(physics.due()):
+                        if until():
+                            break
+                        sim.step()
+                    time.sleep(min(physics.wait_time(), self.poll))
+        finally:
+            # nobody steps any more, release the waiting connections
+            with self.wakeup:
+                self.stopped = True
+            while self.requests:
+                self.requests.popleft()[1].set()
+        return sim.tick
@@ -1,30 +1,25 @@
 import sys
+import time
+import asyncio
 import pygame
-import socket
-import threading
 from pygame.locals import *
+from simcore import ElevatorCore, Simulation, FixedStep, TICK_RATE
+from aioserver import AsyncElevatorServer
+from channel import Channel
 
-class Elevator:
+class Elevator(ElevatorCore):
     def __init__(self, levels):
-        self.levels = levels
         # Initialize elevator state variables
-        self.position = 0.0
-        self.door_position = 0.0
-        self.direction = 0  # 0: stop, 1: up, -1: down
-        self.speed = 0.0
-        self.door_motor = 0  # 0: off, 1: opening, -1: closing
-        self.motor_overheat = 0
-        self.door_motor_overheat = 0
-        self.defect = False
-        self.door_defect = False
+        ElevatorCore.__init__(self, levels)
         # Initialize Pygame components for visualization
         self.init_pygame()
 
     def init_pygame(self):
-        pygame.init()
+        # only what is drawn, not every subsystem
+        pygame.display.init()
+        pygame.font.init()
         self.screen = pygame.display.set_mode((250, self.levels * 50))
         pygame.display.set_caption("Elevator Simulator")
-        self.clock = pygame.time.Clock()
         self.all_sprites = pygame.sprite.Group()
         self.create_buttons()
         self.create_background()
@@ -33,11 +28,13 @@ class Elevator:
     def create_buttons(self):
         # Create elevator buttons and lamps
         self.buttons = []
+        self.lamps = {}  # button name -> Lamp
         for level in range(self.levels):
             button = ElevatorButton(level)
             lamp = Lamp(level)
             self.buttons.append(button)
             self.buttons.append(lamp)
+            self.lamps["level %d" % (level + 1)] = lamp
             self.all_sprites.add(button, lamp)
 
     def create_background(self):
@@ -56,55 +53,27 @@ class Elevator:
         # Load fonts for rendering text
         self.font = pygame.font.Font("freesansbold.ttf", 13)
 
-    def run_simulation(self):
+    def run_simulation(self, physics_rate=TICK_RATE, render_rate=TICK_RATE,
+                       tick_hooks=()):
+        # physics runs at a fixed rate, independent of how fast we render
+        sim = Simulation(self, rate=None)
+        sim.tick_hooks.extend(tick_hooks)
+        physics = FixedStep(physics_rate)
+        render = FixedStep(render_rate) if render_rate else None
         while not self.defect:
             for event in pygame.event.get():
                 if event.type == QUIT:
                     self.defect = True
                 elif event.type == KEYDOWN and event.key == K_ESCAPE:
                     self.defect = True
-            self.update()
-            self.draw()
-
-    def update(self):
-        # Update elevator position and state
-        if self.direction == 1:
-            if self.speed < 0.01:
-                self.speed += 0.0001
-        elif self.direction == -1:
-            if self.speed > -0.01:
-                self.speed -= 0.0001
-        else:
-            if abs(self.speed) > 0.00001:
-                self.speed -= 0.0001
-            else:
-                self.speed = 0.0
-
-        # Update elevator position based on speed
-        self.position += self.speed
-
-        # Check for elevator position limits
-        if self.position < 0.0:
-            self.position = 0.0
-            self.motor_overheat += 1
-        elif self.position > 1.0:
-            self.position = 1.0
-            self.motor_overheat += 1
-
-        # Update door status and motor
-        if not self.door_defect:
-            if self.door_motor == -1:
-                self.door_position -= 0.01
-            elif self.door_motor == 1:
-                self.door_position += 0.01
-
-            # Check for door position limits
-            if self.door_position < 0.0:
-                self.door_position = 0.0
-                self.door_motor_overheat += 1
-            elif self.door_position > 1.0:
-                self.door_position = 1.0
-                self.door_motor_overheat += 1
+            for _ in range(physics.due()):
+                sim.step()
+            if render and render.due():
+                self.draw()
+            wait = physics.wait_time()
+            if render:
+                wait = min(wait, render.wait_time())
+            time.sleep(wait)
 
     def draw(self):
         # Draw elevator and buttons
@@ -116,7 +85,6 @@ class Elevator:
         self.display_info()
 
         pygame.display.flip()
-        self.clock.tick(60)
 
     def display_info(self):
         # Display elevator information on the screen
@@ -138,82 +106,25 @@ class Elevator:
             self.screen.blit(info_text, (90, y_offset))
             y_offset += info_text.get_height() + 2
 
-    def current_level(self):
-        # Calculate and return the current level
-        return int(self.position * (self.levels - 1) + 0.5)
-
-    def is_defect(self):
-        return self.defect
-
-    def is_door_defect(self):
-        return self.door_defect
-
-    def is_door_closed(self):
-        return self.door_position <= 0.1
-
-    def is_door_open(self):
-        return self.door_position >= 0.9
-
-    def save_to_open_door(self):
-        delta = int(self.position * (self.levels - 1)) - self.position * (self.levels - 1)
-        return -0.04 < delta < 0.04
-
-    def motor_status(self):
-        if self.motor_overheat < 6:
-            return "ok"
-        elif self.motor_overheat < 60:
-            return "overheating"
-        else:
-            self.defect = True
-            return "broken"
-
-    def door_motor_status(self):
-        if self.door_motor_overheat < 6:
-            return "ok"
-        elif self.door_motor_overheat < 60:
-            return "overheating"
-        else:
-            self.door_defect = True
-            return "broken"
-
-    def up(self):
-        self.direction = 1
-
-    def down(self):
-        self.direction = -1
-
-    def stop(self):
-        self.direction = 0
-
-    def door_open(self):
-        self.door_motor = 1
-
-    def door_close(self):
-        self.door_motor = -1
-
-    def door_stop(self):
-        self.door_motor = 0
-
-    def repair(self):
-        self.motor_overheat = 0
-        self.direction = 0
-        self.speed = 0.0
-        self.defect = False
-
-    def repair_door(self):
-        self.door_motor_overheat = 0
-        self.door_motor = 0
-        self.door_defect = False
-
     def lamp_on(self, name):
-        for button in self.buttons:
-            if isinstance(button, Lamp) and button.label == name:
-                button.on()
+        ElevatorCore.lamp_on(self, name)
+        lamp = self.lamps.get(name)
+        if lamp is not None:
+            lamp.on()
 
     def lamp_off(self, name):
-        for button in self.buttons:
-            if isinstance(button, Lamp) and button.label == name:
-                button.off()
+        ElevatorCore.lamp_off(self, name)
+        lamp = self.lamps.get(name)
+        if lamp is not None:
+            lamp.off()
+
+    def set_lamps(self, mask):
+        ElevatorCore.set_lamps(self, mask)
+        for name, lamp in self.lamps.items():
+            if self.button_lamps[name]:
+                lamp.on()
+            else:
+                lamp.off()
 
 class ElevatorButton(pygame.sprite.Sprite):
     def __init__(self, level):
@@ -257,55 +168,40 @@ class Lamp(ElevatorButton):
         self.render_text()
 
 
-def serve_connection(conn, addr, elevator):
-    conn.settimeout(1)
-    while not elevator.is_defect():
-        try:
-            conn.send("# ")
-            data = conn.recv(256)
-            if not data:
-                break
-            command = data.strip()
-            response = elevator.handle_command(command)
-            conn.send(f"{response}\r\n")
-        except socket.timeout:
-            pass
-    conn.close()
-
-
 class ElevatorServer:
+    """Control server for the elevator, all connections are served on one
+    asyncio event loop."""
     def __init__(self, elevator, port=23300):
         self.elevator = elevator
         self.port = port
-        self.terminate = False
-        self.sock = None
+        # tick hook applying the commands of the connections
+        self.channel = Channel(elevator)
+        self.server = AsyncElevatorServer(elevator, port,
+                                          on_terminate=self.stop,
+                                          channel=self.channel)
 
     def start(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(1.0)
-        self.sock.bind(("localhost", self.port))
-        while not self.terminate:
-            try:
-                self.sock.listen(1)
-                conn, addr = self.sock.accept()
-                threading.Thread(target=serve_connection, args=(conn, addr, self.elevator)).start()
-            except socket.timeout:
-                pass
+        asyncio.run(self.server.serve())
+
+    def start_in_thread(self):
+        self.server.start_in_thread()
 
     def stop(self):
-        self.terminate = True
-        if self.sock:
-            self.sock.close()
+        self.server.stop()
 
 
-def main():
+def main(physics_rate=TICK_RATE, render_rate=TICK_RATE):
+    if not physics_rate > 0 or not render_rate >= 0:
+        sys.exit("usage: main.py [physics rate above 0] "
+                 "[render rate, 0 for none]")
     levels = 10  # Change this to the desired number of levels
     elevator = Elevator(levels)
     elevator_server = ElevatorServer(elevator)
-    elevator.run_simulation()
-    elevator_server.start()
+    elevator_server.start_in_thread()
+    elevator.run_simulation(physics_rate, render_rate,
+                            [elevator_server.channel])
     elevator_server.stop()
 
 
 if __name__ == '__main__':
-    main()
+    main(*[float(rate) for rate in sys.argv[1:3]])
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Monte Carlo runs of ELSIM
+the same traffic scenario with many seeds over a grid of parameters, run
+headless on all CPU cores; every finished run is printed as one JSON line
+as soon as it arrives, followed by summary statistics per grid point
+"""
+import sys
+import json
+import math
+import argparse
+import inspect
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import traffic
+from simcore import PHYSICS
+
+# parameters of traffic.simulate() and their defaults; any other grid
+# parameter is one of simcore.PHYSICS like maxspeed or overheat_max
+DEFAULTS = {"levels": 10, "controller": "collective",
+            "profile": "interfloor", "rate": 200, "hours": 1.0}
+# what a grid can vary: the arguments of simulate() but the seed, PHYSICS
+GRID_PARAMETERS = {name for name, parameter
+                   in inspect.signature(traffic.simulate).parameters.items()
+                   if parameter.kind is parameter.POSITIONAL_OR_KEYWORD and
+                   name != "seed"} | set(PHYSICS)
+METRICS = ("wait_mean", "wait_p95", "journey_mean", "journey_p95",
+           "passengers_per_hour")
+
+
+def scenarios(grid, seeds):
+    """One scenario dict for every combination of the grid values (a dict
+    name -> list of values) and every seed."""
+    names = sorted(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        for seed in seeds:
+            scenario = dict(DEFAULTS)
+            scenario.update(zip(names, values))
+            scenario["seed"] = seed
+            yield scenario
+
+
+def run_scenario(scenario):
+    """Run one scenario (in a worker process), return it with its metrics."""
+    result = dict(scenario)
+    result.update(traffic.simulate(**scenario))
+    return result
+
+
+def run(scenarios, workers=None):
+    """Run the scenarios on a pool of workers processes (one per CPU by
+    default) and yield each result as soon as it is finished."""
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(run_scenario, scenario)
+                   for scenario in scenarios]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class Summary:
+    """Streaming mean, standard deviation, min and max of the metrics of
+    the runs of each grid point (Welford's algorithm)."""
+
+    def __init__(self, keys):
+        self.keys = keys  # the grid parameters identifying a grid point
+        self.points = {}  # grid values -> metric -> [n, mean, m2, min, max]
+
+    def add(self, result):
+        point = self.points.setdefault(
+            tuple(result[key] for key in self.keys),
+            {metric: [0, 0.0, 0.0, math.inf, -math.inf]
+             for metric in METRICS})
+        for metric, stats in point.items():
+            value = result[metric]
+            stats[0] += 1
+            delta = value - stats[1]
+            stats[1] += delta / stats[0]
+            stats[2] += delta * (value - stats[1])
+            stats[3] = min(stats[3], value)
+            stats[4] = max(stats[4], value)
+
+    def results(self):
+        for values in sorted(self.points, key=repr):
+            summary = dict(zip(self.keys, values))
+            for metric, (n, mean, m2, low, high) in \
+                    self.points[values].items():
+                summary[metric] = {
+                    "runs": n, "mean": mean,
+                    "stdev": math.sqrt(m2 / (n-1)) if n > 1 else 0.0,
+                    "min": low, "max": high}
+            yield summary
+
+
+def parse_value(text):
+    if text in ("True", "False"):
+        return text == "True"
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_grid(specs):
+    """Turn ["levels=10,20", "maxspeed=0.01,0.02"] into a grid dict."""
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        name = name.strip()
+        if not values:
+            raise ValueError("grid parameter %s has no values" % spec)
+        if name not in GRID_PARAMETERS:
+            raise ValueError("unknown grid parameter %s" % name)
+        grid[name] = [parse_value(v.strip()) for v in values.split(",")]
+        if name == "rate" and not all(isinstance(v, (int, float)) and v >= 0
+                                      for v in grid[name]):
+            raise ValueError("rates must be numbers of at least 0")
+    return grid
+
+
+def main(*arg):
+    """Run a traffic scenario over a parameter grid and many seeds in
+    parallel, print every run and then the summary per grid point as JSON
+    lines."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--grid", action="append", default=[],
+                        metavar="NAME=V1,V2",
+                        help="values of a parameter, e.g. levels=10,20 or "
+                             "maxspeed=0.01,0.02 (repeatable)")
+    parser.add_argument("--seeds", type=int, default=10,
+                        help="runs per grid point")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--workers", type=int,
+                        help="worker processes, one per CPU by default")
+    parser.add_argument("--summary-only", action="store_true",
+                        help="do not print the single runs")
+    parser.add_argument("--output", help="also write the lines to this file")
+    args = parser.parse_args(arg)
+    try:
+        grid = parse_grid(args.grid)
+    except ValueError as msg:
+        parser.error(msg)
+    output = open(args.output, "w") if args.output else None
+
+    def emit(record):
+        line = json.dumps(record)
+        print(line, flush=True)
+        if output:
+            output.write(line + "\n")
+
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    summary = Summary(sorted(set(grid) | set(DEFAULTS)))
+    for result in run(scenarios(grid, seeds), args.workers):
+        summary.add(result)
+        if not args.summary_only:
+            emit(result)
+    for record in summary.results():
+        record["summary"] = True
+        emit(record)
+    if output:
+        output.close()
+
+
+if __name__ == '__main__':
+    main(*(sys.argv)[1:])
@@ -0,0 +1,96 @@
+"""
+Push notifications of ELSIM
+the elevator state is diffed once per tick and every change is pushed as an
+"event <kind> <value>" line to the connections subscribed to that kind
+"""
+import threading
+
+from eventsim import overheat_status
+
+EVENT_KINDS = ("level", "door", "button", "motor", "door motor",
+               "defect", "door defect")
+STATUS_NAMES = ("ok", "overheating", "broken")
+EVENT_PREFIX = "event "
+
+
+def door_state(elevator):
+    if elevator.is_door_open():
+        return "open"
+    elif elevator.is_door_closed():
+        return "closed"
+    return "moving"
+
+
+class Notifier:
+    """Detect events of elevator and push them to subscribers.
+    A subscriber is a function called with the text of one event line."""
+
+    def __init__(self, elevator):
+        self.elevator = elevator
+        self.subscriptions = {}  # push function -> set of kinds
+        self.lock = threading.Lock()
+        self._last = None
+
+    def subscribe(self, push, kinds=EVENT_KINDS):
+        for kind in kinds:
+            if kind not in EVENT_KINDS:
+                raise ValueError("unknown event %s" % kind)
+        with self.lock:
+            if not self.subscriptions:
+                self._last = None  # start diffing from the current state
+            self.subscriptions.setdefault(push, set()).update(kinds)
+
+    def unsubscribe(self, push, kinds=EVENT_KINDS):
+        with self.lock:
+            remaining = self.subscriptions.get(push, set()) - set(kinds)
+            if remaining:
+                self.subscriptions[push] = remaining
+            else:
+                self.subscriptions.pop(push, None)
+
+    def subscribed(self, push):
+        return sorted(self.subscriptions.get(push, ()))
+
+    def state(self):
+        """The observed state, one value per event kind; button states
+        are a frozenset of pressed buttons."""
+        e = self.elevator
+        return (e.current_level(),
+                door_state(e),
+                frozenset(e.button_states.on()),
+                STATUS_NAMES[overheat_status(e, e.motor_overheat)],
+                STATUS_NAMES[overheat_status(e, e.door_motor_overheat)],
+                e.defect and "yes" or "no",
+                e.door_defect and "yes" or "no")
+
+    def changes(self, before, after):
+        """Yield (kind, text) for every difference of two states."""
+        for kind, old, new in zip(EVENT_KINDS, before, after):
+            if old == new:
+                continue
+            if kind == "button":
+                for name in sorted(new - old):
+                    yield kind, "%sbutton %s pressed" % (EVENT_PREFIX, name)
+                for name in sorted(old - new):
+                    yield kind, "%sbutton %s released" % (EVENT_PREFIX, name)
+            else:
+                yield kind, "%s%s %s" % (EVENT_PREFIX, kind, new)
+
+    def poll(self, sim=None):
+        """Diff the state against the last poll and push the changes;
+        to be called once per tick (a Simulation tick hook)."""
+        if not self.subscriptions:
+            return
+        state = self.state()
+        last, self._last = self._last, state
+        if last is None or last == state:
+            return
+        with self.lock:
+            subscriptions = list(self.subscriptions.items())
+        for kind, text in self.changes(last, state):
+            for push, kinds in subscriptions:
+                if kind in kinds:
+                    try:
+                        push(text)
+                    except OSError:
+                        self.unsubscribe(push)
@@ -0,0 +1,322 @@
+"""
+The line based control protocol of ELSIM
+one command per line, each answered with one reply followed by the
+prompt; shared by the threaded and the asyncio server
+"""
+
+from notify import EVENT_KINDS
+
+PROMPT = "# "
+ENCODING = "utf-8"
+
+# fields of status?, in reply order; each is the name of a query without "?"
+STATUS_FIELDS = ("level", "door open", "door closed", "save to open",
+                 "speed", "motor status", "door motor", "defect",
+                 "door defect", "pressed", "lamps")
+
+
+def encode(text):
+    return text.encode(ENCODING)
+
+
+def decode(data):
+    return data.decode(ENCODING, errors="replace")
+
+
+def split_lines(data):
+    """Split received bytes into complete lines and the unfinished rest."""
+    *lines, rest = data.split(b"\n")
+    return [decode(line) for line in lines], rest
+
+
+def takes_argument(f):
+    """Mark a command function which is called with the rest of the line,
+    like status? for "status? level, speed"."""
+    f.takes_argument = True
+    return f
+
+
+def yesno(value):
+    return value and "yes" or "no"
+
+
+_button_lines = {}  # levels -> (bit, pressed line, released line) by name
+
+def button_states_list(elevator):
+    states = elevator.button_states
+    lines = _button_lines.get(elevator.levels)
+    if lines is None:
+        lines = _button_lines[elevator.levels] = [
+            (1 << states.index[name], "%s:pressed" % name,
+             "%s:released" % name) for name in sorted(states)]
+    bits = states.bits
+    return "\r\n".join(bits & bit and pressed or released
+                       for bit, pressed, released in lines)
+
+
+def pressed_list(elevator):
+    return ",".join(sorted(elevator.button_states.on()))
+
+
+def lamps_list(elevator):
+    return ",".join(sorted(elevator.button_lamps.on()))
+
+
+# the queries, each a function of the elevator (or of a channel.Snapshot)
+QUERIES = {
+    "level?": lambda e: e.current_level(),
+    "door open?": lambda e: yesno(e.is_door_open()),
+    "door closed?": lambda e: yesno(e.is_door_closed()),
+    "save to open?": lambda e: yesno(e.save_to_open_door()),
+    "defect?": lambda e: yesno(e.defect),
+    "door defect?": lambda e: yesno(e.door_defect),
+    "motor status?": lambda e: e.motor_status(),
+    "door motor?": lambda e: e.door_motor_status(),
+    "speed?": lambda e: "%s"%(e.speed*1000),
+    "buttons?": button_states_list,
+    "pressed?": pressed_list,
+    "lamps?": lamps_list,
+    # hexadecimal bit masks in simcore.button_names() order
+    "buttons mask?": lambda e: "%x" % e.button_states.bits,
+    "lamps mask?": lambda e: "%x" % e.button_lamps.bits,
+}
+
+# the commands changing the elevator, each calls a method with no argument
+COMMANDS = {
+    "up": "up",
+    "down": "down",
+    "stop": "stop",
+    "open door": "door_open",
+    "close door": "door_close",
+    "stop door": "door_stop",
+    "repair": "repair",
+    "repair door": "repair_door",
+}
+
+
+def command_table(elevator, terminate, end_connection, notifier=None,
+                  push=None, client=None, stepper=None):
+    """Return the dictionary of commands for one connection.
+    terminate is called for the terminate command (stops the simulator),
+    end_connection for exit. With a notify.Notifier the connection can
+    subscribe to events, which are sent with push. With a channel.Client
+    the commands are queued for the next tick and the queries answered
+    from the last snapshot (after sync, one showing the connection's
+    commands); without, both act on elevator directly.
+    With a lockstep.Stepper the connection can set the time scale and
+    step the simulation."""
+
+    if client is None:
+        view = lambda: elevator
+        submit = lambda line, f: f()
+    else:
+        view, submit = client.view, client.submit
+
+    def help():
+        return "Possible commands: %s"%", ".join(
+            sorted(getattr(f, "usage", name) for name, f in flist.items()))
+
+    # concat two statements
+    def concat(f,s):
+        f()
+        return s
+
+    # returns a functional operator for returning ok and executing something
+    def ok(f):
+        return lambda: concat(f, "OK")
+
+    # returns a command changing the elevator, answered with ok
+    def write(line, f):
+        return ok(lambda: submit(line, f))
+
+    def query(f):
+        return lambda: f(view())
+
+    index = elevator.button_lamps.index
+
+    @takes_argument
+    def lamp(argument=""):
+        """lamp <button> on, lamp <button> off and lamp <button>?"""
+        if argument.endswith("?"):
+            name = argument[:-1]
+            if name not in index:
+                return "unknown command"
+            return view().lamp(name) and "on" or "off"
+        name, _, switch = argument.rpartition(" ")
+        if name not in index or switch not in ("on", "off"):
+            return "unknown command"
+        line = "lamp %s %s" % (name, switch)
+        if switch == "on":
+            submit(line, lambda: elevator.lamp_on(name))
+        else:
+            submit(line, lambda: elevator.lamp_off(name))
+        return "OK"
+    lamp.usage = "lamp <button> on|off|?"
+
+    @takes_argument
+    def lamps(argument=""):
+        """lamps mask <hex>: set all lamps from a mask as of lamps mask?"""
+        words = argument.split()
+        if len(words) != 2 or words[0] != "mask":
+            return "unknown command"
+        try:
+            mask = int(words[1], 16)
+        except ValueError:
+            return "bad mask %s" % words[1]
+        if mask < 0 or mask >> len(index):
+            return "bad mask %s" % words[1]
+        submit("lamps mask %x" % mask, lambda: elevator.set_lamps(mask))
+        return "OK"
+    lamps.usage = "lamps mask <hex>"
+
+    @takes_argument
+    def status(fields=None):
+        """The state in one reply, one field:value per line;
+        fields is a comma separated selection of STATUS_FIELDS."""
+        if fields is None:
+            fields = STATUS_FIELDS
+        else:
+            fields = [field.strip() for field in fields.split(",")]
+        state = view()  # all fields from the same tick
+        lines = []
+        for field in fields:
+            f = QUERIES.get(field + "?")
+            if field not in STATUS_FIELDS or f is None:
+                return "unknown field %s" % field
+            lines.append("%s:%s" % (field, f(state)))
+        return "\r\n".join(lines)
+
+    def event_kinds(kinds):
+        if kinds is None:
+            return EVENT_KINDS
+        return [kind.strip() for kind in kinds.split(",")]
+
+    @takes_argument
+    def subscribe(kinds=None):
+        """Subscribe to a comma separated list of event kinds (all if none)."""
+        try:
+            notifier.subscribe(push, event_kinds(kinds))
+        except ValueError as msg:
+            return msg
+        return "OK"
+
+    @takes_argument
+    def unsubscribe(kinds=None):
+        notifier.unsubscribe(push, event_kinds(kinds))
+        return "OK"
+
+    @takes_argument
+    def step(argument=""):
+        """step [<ticks>] and step until <event kinds>: advance the paused
+        simulation, reply with its tick and the events stopping it."""
+        if stepper.scale:
+            return "not in lockstep mode, set time scale 0"
+        words = argument.split(None, 1)
+        if not words:
+            tick, events = stepper.step(1)
+        elif words[0] == "until" and len(words) == 2:
+            kinds = event_kinds(words[1])
+            for kind in kinds:
+                if kind not in EVENT_KINDS:
+                    return "unknown event kind %s" % kind
+            tick, events = stepper.step(kinds=kinds)
+        elif len(words) == 1 and words[0].isdigit() and \
+                0 < int(words[0]) <= stepper.limit:
+            tick, events = stepper.step(int(words[0]))
+        else:
+            return "usage: %s" % step.usage
+        return "\r\n".join(["%d" % tick] + events)
+    step.blocking = True
+    step.usage = "step [<ticks>|until <event kinds>]"
+
+    def sync():
+        """sync: wait until the earlier commands of the connection are
+        applied, answer the tick whose state shows them."""
+        return client.sync().tick
+    sync.blocking = True
+
+    @takes_argument
+    def time(argument=""):
+        """time scale <factor>: simulate at factor times real time, max as
+        fast as possible, 0 in lockstep (only step advances)."""
+        words = argument.split()
+        if len(words) != 2 or words[0] != "scale":
+            return "usage: %s" % time.usage
+        try:
+            scale = float(words[1].replace("max", "inf"))
+        except ValueError:
+            return "bad time scale %s" % words[1]
+        if not scale >= 0:
+            return "bad time scale %s" % words[1]
+        stepper.set_scale(scale)
+        return "OK"
+    time.blocking = True
+    time.usage = "time scale <factor>|max"
+
+    flist = {
+        "status?": status,
+        "lamp": lamp,
+        "lamps": lamps,
+        "lamps off": write("lamps off", elevator.lamps_off),
+        "help": help,
+        "terminate": ok(terminate),
+        "exit": ok(end_connection)
+    }
+    for name, method in COMMANDS.items():
+        flist[name] = write(name, getattr(elevator, method))
+    for name, f in QUERIES.items():
+        flist[name] = query(f)
+
+    if notifier is not None:
+        flist["subscribe"] = subscribe
+        flist["unsubscribe"] = unsubscribe
+        flist["subscriptions?"] = lambda: ",".join(notifier.subscribed(push))
+    if client is not None:
+        flist["tick?"] = lambda: view().tick
+        flist["sync"] = sync
+    if stepper is not None:
+        flist["step"] = step
+        flist["time"] = time
+        flist["time scale?"] = lambda: ("%g" % stepper.scale).replace(
+            "inf", "max")
+
+    return flist
+
+
+def lookup(flist, line):
+    """The command function for a stripped line and its argument (None if
+    it takes none), or (None, None) for an unknown command."""
+    if line in flist:
+        return flist[line], None
+    command, _, argument = line.partition(" ")
+    f = flist.get(command)
+    if f is not None and getattr(f, "takes_argument", False):
+        return f, argument
+    return None, None
+
+
+def execute(flist, line):
+    """Execute one command line, return the reply or None for an empty line."""
+    line = line.strip()
+    if not line:
+        return None
+    f, argument = lookup(flist, line)
+    if f is None:
+        return "unknown command"
+    if argument is None:
+        return "%s" % f()
+    return "%s" % f(argument)
+
+
+def execute_lines(flist, lines, is_open=lambda: True):
+    """Execute pipelined command lines in order, return all replies each
+    followed by the prompt as one string; stops when is_open() turns false."""
+    out = []
+    for line in lines:
+        reply = execute(flist, line)
+        if reply is not None:
+            out.append("%s\r\n" % reply)
+        if not is_open():
+            break
+        out.append(PROMPT)
+    return "".join(out)
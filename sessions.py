@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Multi-tenant control server of ELSIM
+one headless process hosting many independent buildings (sessions), each
+with its own elevator, levels and physics; all are stepped by one shared
+tick scheduler and served by one asyncio server. A connection starts in
+the lobby and creates, attaches to or destroys sessions by id.
+"""
+import sys
+import time
+import argparse
+import itertools
+import threading
+
+from simcore import ElevatorCore, Simulation, FixedStep, TICK_RATE, PHYSICS
+from protocol import takes_argument
+from aioserver import AsyncElevatorServer
+from notify import Notifier
+from channel import Channel
+
+
+def parse_physics(assignments):
+    """The simcore.PHYSICS parameters of name=value words."""
+    physics = {}
+    for assignment in assignments:
+        name, _, value = assignment.partition("=")
+        if not value or name not in PHYSICS:
+            raise ValueError("unknown elevator parameter %s" % name)
+        try:
+            physics[name] = int(value)
+        except ValueError:
+            physics[name] = float(value)
+    return physics
+
+
+class Session:
+    """One building: an elevator stepped by a Simulation without pacing of
+    its own, with the notifier and channel of its connections."""
+
+    def __init__(self, session_id, levels, **physics):
+        self.id = session_id
+        elevator = ElevatorCore(levels)
+        for name, value in physics.items():
+            setattr(elevator, name, value)
+        self.sim = Simulation(elevator, rate=None)
+        self.notifier = Notifier(elevator)
+        self.sim.tick_hooks.append(self.notifier.poll)
+        self.channel = Channel(elevator, self.sim.tick)
+        self.sim.tick_hooks.append(self.channel)
+        self.closed = False
+
+    @property
+    def elevator(self):
+        return self.sim.elevator
+
+    def describe(self):
+        return "%s levels %d tick %d" % (self.id, self.elevator.levels,
+                                         self.sim.tick)
+
+
+class SessionManager:
+    """The sessions of one process; run_forever() steps all of them once
+    per tick at rate ticks per second."""
+    max_levels = 1000
+
+    def __init__(self, rate=TICK_RATE, max_sessions=1000):
+        self.rate = rate
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.running = ()  # the sessions stepped, replaced on every change
+        self.lock = threading.Lock()
+        self.terminate = False
+        self._ids = itertools.count(1)
+
+    def create(self, levels, **physics):
+        if not 3 <= levels <= self.max_levels:
+            raise ValueError("levels must be between 3 and %d"
+                             % self.max_levels)
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise ValueError("too many sessions")
+            session = Session("s%d" % next(self._ids), levels, **physics)
+            self.sessions[session.id] = session
+            self.running = tuple(self.sessions.values())
+        return session
+
+    def destroy(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                raise KeyError(session_id)
+            session.closed = True
+            self.running = tuple(self.sessions.values())
+        return session
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def step(self):
+        """Advance every session by one tick."""
+        for session in self.running:
+            session.sim.step()
+
+    def run_forever(self, until=None):
+        """Step all sessions until terminate is set (or until() returns
+        true), paced to rate ticks per second (None or 0: unpaced)."""
+        if not self.rate:
+            while not self.terminate and not (until and until()):
+                self.step()
+            return
+        physics = FixedStep(self.rate)
+        while True:
+            for _ in range(physics.due()):
+                if self.terminate or (until and until()):
+                    return
+                self.step()
+            time.sleep(physics.wait_time())
+
+
+class SessionServer(AsyncElevatorServer):
+    """AsyncElevatorServer for the sessions of manager. In the lobby a
+    connection knows only the session commands; once attached it also has
+    the protocol of its session, where terminate destroys the session."""
+
+    def __init__(self, manager, port=23300, host="localhost",
+                 on_terminate=None):
+        AsyncElevatorServer.__init__(self, None, port, host, on_terminate)
+        self.manager = manager
+        self.attached = {}  # session id -> set of connections
+
+    def open_connection(self, connection):
+        connection.session = None
+        connection.flist = self.lobby(connection)
+
+    def close_connection(self, connection):
+        self.leave(connection)
+
+    def leave(self, connection):
+        session = connection.session
+        if session is not None:
+            self.attached.get(session.id, set()).discard(connection)
+            connection.session = None
+        self.detach(connection)
+        connection.flist = self.lobby(connection)
+
+    def join(self, connection, session):
+        self.leave(connection)
+        connection.session = session
+        self.attached.setdefault(session.id, set()).add(connection)
+        self.attach(connection, session.elevator, session.notifier,
+                    session.channel, lambda: self.destroy(session.id))
+        connection.flist.update(self.lobby(connection))
+
+    def destroy(self, session_id):
+        """Destroy a session and move its connections to the lobby."""
+        self.manager.destroy(session_id)
+        for connection in self.attached.pop(session_id, ()):
+            connection.session = None
+            self.leave(connection)
+            if connection.binary:
+                connection.end()  # its frames were for the session
+            connection.push("event session %s destroyed" % session_id)
+
+    def lobby(self, connection):
+        """The session commands of connection."""
+        manager = self.manager
+
+        @takes_argument
+        def session(argument=""):
+            words = argument.split()
+            if not words:
+                return "usage: session create|attach|detach|destroy ..."
+            action, args = words[0], words[1:]
+            if action == "create":
+                if not args or not args[0].isdigit():
+                    return "usage: session create <levels> [name=value ...]"
+                try:
+                    created = manager.create(int(args[0]),
+                                             **parse_physics(args[1:]))
+                except ValueError as e:
+                    return "%s" % e
+                self.join(connection, created)
+                return created.id
+            if action == "attach":
+                if not 1 <= len(args) <= 2 or args[1:] not in ([], ["binary"]):
+                    return "usage: session attach <id> [binary]"
+                found = manager.get(args[0])
+                if found is None:
+                    return "unknown session %s" % args[0]
+                self.join(connection, found)
+                if args[1:]:
+                    connection.binary = True
+                    return "OK %d" % found.elevator.levels
+                return "OK"
+            if action == "destroy":
+                if len(args) > 1:
+                    return "usage: session destroy [<id>]"
+                if args:
+                    session_id = args[0]
+                elif connection.session is not None:
+                    session_id = connection.session.id
+                else:
+                    return "not attached"
+                try:
+                    self.destroy(session_id)
+                except KeyError:
+                    return "unknown session %s" % session_id
+                return "OK"
+            if action == "detach" and not args:
+                self.leave(connection)
+                return "OK"
+            return "unknown session command %s" % action
+
+        def current():
+            if connection.session is None:
+                return "none"
+            return connection.session.describe()
+
+        def help():
+            return "\r\n".join(sorted(connection.flist))
+
+        def end():
+            connection.end()
+            return "bye"
+
+        flist = {"session": session,
+                 "session?": current,
+                 "sessions?": lambda: "\r\n".join(
+                     s.describe() for s in manager.running) or "none"}
+        if connection.session is None:
+            flist.update({"help": help, "exit": end})
+        return flist
+
+
+def main(*arg):
+    """Serve many independent headless elevator simulations on one port."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("port", nargs="?", type=int, default=23300)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--rate", type=int, default=TICK_RATE,
+                        help="ticks per second of every session, 0 unpaced")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    args = parser.parse_args(arg)
+    manager = SessionManager(args.rate, args.max_sessions)
+    server = SessionServer(manager, args.port, args.host)
+    server.start_in_thread()
+    print("serving sessions on %s:%d" % (args.host, args.port))
+    try:
+        manager.run_forever()
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+
+
+if __name__ == '__main__':
+    main(*(sys.argv)[1:])
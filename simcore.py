@@ -0,0 +1,492 @@
+#!/usr/bin/env python
+"""
+Headless simulation core of ELSIM
+the kinematics, door motor and overheat logic of the elevator without any
+rendering, so it runs without pygame and as fast as the CPU allows
+(or paced to a fixed tick rate)
+"""
+import sys
+import time
+import struct
+import argparse
+from collections.abc import Mapping, MutableMapping
+
+TICK_RATE = 60  # ticks per second of the original visual simulator
+
+
+def button_names(levels):
+    """Return the names of all buttons of a building with levels floors,
+    in the order the visual simulator creates them."""
+    names = []
+    for i in range(levels-1):
+        names.append("up %d" % (levels-i-1))
+        names.append("down %d" % (levels-i))
+        names.append("level %d" % (levels-i))
+    names.append("level 1")
+    return names
+
+
+def button_index(levels, kind, floor):
+    """The index of the kind ("up", "down" or "level") button of floor
+    in button_names(levels)."""
+    if kind == "up" and 1 <= floor < levels:
+        return 3*(levels-1-floor)
+    if kind == "down" and 1 < floor <= levels:
+        return 3*(levels-floor) + 1
+    if kind == "level" and 1 <= floor <= levels:
+        return 3*(levels-floor) + 2 if floor > 1 else 3*(levels-1)
+    raise ValueError("no %s button on floor %d" % (kind, floor))
+
+
+_layouts = {}  # levels -> (names, name -> index), shared by all cars
+
+def _button_layout(levels):
+    layout = _layouts.get(levels)
+    if layout is None:
+        names = tuple(button_names(levels))
+        layout = _layouts[levels] = (names, {n: i for i, n in enumerate(names)})
+    return layout
+
+
+class Buttons(MutableMapping):
+    """The buttons (or lamps) of a car as the bits of one int, in
+    button_names() order; it reads and writes like the dict name -> bool
+    it replaces. bits can be used directly as the bit mask."""
+    __slots__ = ("names", "index", "bits")
+
+    def __init__(self, levels, bits=0):
+        self.names, self.index = _button_layout(levels)
+        self.bits = bits
+
+    def __getitem__(self, name):
+        return bool(self.bits >> self.index[name] & 1)
+
+    def __setitem__(self, name, on):
+        if on:
+            self.bits |= 1 << self.index[name]
+        else:
+            self.bits &= ~(1 << self.index[name])
+
+    def __delitem__(self, name):
+        raise TypeError("buttons cannot be removed")
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __eq__(self, other):
+        if isinstance(other, Buttons):
+            return self.bits == other.bits and self.names is other.names
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, dict(self))
+
+    @property
+    def levels(self):
+        return len(self.names) // 3 + 1
+
+    def at(self, kind, floor):
+        """The bit of the kind ("up", "down" or "level") button of floor."""
+        return bool(self.bits >> button_index(self.levels, kind, floor) & 1)
+
+    def set_at(self, kind, floor, on):
+        self[self.names[button_index(self.levels, kind, floor)]] = on
+
+    def clear(self):
+        self.bits = 0
+
+    def set_mask(self, bits):
+        """Set all bits at once, bits beyond the last button are dropped."""
+        self.bits = bits & ((1 << len(self.names)) - 1)
+
+    def on(self):
+        """The names of the set bits (pressed buttons or lit lamps)."""
+        names, bits = self.names, self.bits
+        result = []
+        while bits:
+            low = bits & -bits
+            result.append(names[low.bit_length()-1])
+            bits ^= low
+        return result
+
+    def copy(self):
+        return Buttons(self.levels, self.bits)
+
+    def frozen(self):
+        """A read-only copy."""
+        return FrozenButtons(self.levels, self.bits)
+
+    def to_bytes(self):
+        return self.bits.to_bytes((len(self.names)+7)//8, "little")
+
+
+class FrozenButtons(Buttons):
+    __slots__ = ()
+
+    def _read_only(self, *args):
+        raise TypeError("the buttons of a snapshot cannot be changed")
+
+    __setitem__ = set_mask = clear = _read_only
+
+    def frozen(self):
+        return self
+
+
+# default physics of ElevatorCore, every car can override them
+PHYSICS = {
+    "overheat_low": 6,
+    "overheat_max": 60,
+    "maxspeed": 0.01,  # speed is in [-maxspeed, maxspeed]
+    "speedstep": 0.0001,
+    "door_step": 0.01,
+}
+
+
+class ElevatorCore:
+    """State and physics of one elevator car, without any visualization.
+    Kept in slots, the buttons and lamps in two Buttons bit sets, so many
+    thousand cars fit in memory; the GUI attaches its sprite separately."""
+    __slots__ = ("levels", "door_motor", "speed", "direction", "position",
+                 "door_position", "defect", "door_defect", "motor_overheat",
+                 "door_motor_overheat", "button_lamps", "button_states",
+                 "overheat_low", "overheat_max", "maxspeed", "speedstep",
+                 "door_step")
+
+    def __init__(self, levels):
+        self.levels = levels
+        self.overheat_low = PHYSICS["overheat_low"]
+        self.overheat_max = PHYSICS["overheat_max"]
+        self.maxspeed = PHYSICS["maxspeed"]
+        self.speedstep = PHYSICS["speedstep"]
+        self.door_step = PHYSICS["door_step"]
+        self.door_motor = 0  # 0:off, 1:opening, -1: closing
+        self.speed = 0  # from going down max speed to going up max speed
+        self.direction = 0  # -1 down, 1 up, 0 stop
+        self.position = 0  # [0,1] from down to up
+        self.door_position = 0  # [0,1] closed to open
+        self.defect = False  # Is elevator defect?
+        self.door_defect = False  # Is elevator door defect?
+        self.motor_overheat = 0
+        self.door_motor_overheat = 0
+        self.button_lamps = Buttons(levels)
+        self.button_states = Buttons(levels)
+
+    def is_defect(self):
+        return self.defect
+    def is_door_defect(self):
+        return self.door_defect
+    def is_door_closed(self):
+        return self.door_position <= 0.1
+    def is_door_open(self):
+        return self.door_position >= 0.9
+    def current_level(self):
+        return int(self.position*(self.levels-1) + 0.5)
+    def save_to_open_door(self):
+        delta = int(self.position*(self.levels-1)) - \
+                self.position*(self.levels-1)
+        return delta < 0.04 and delta > -0.04
+    def motor_status(self):
+        if self.motor_overheat < self.overheat_low:
+            return "ok"
+        elif self.motor_overheat < self.overheat_max:
+            return "overheating"
+        return "broken"
+    def door_motor_status(self):
+        if self.door_motor_overheat < self.overheat_low:
+            return "ok"
+        elif self.door_motor_overheat < self.overheat_max:
+            return "overheating"
+        return "broken"
+
+    def update(self):
+        """Advance the physics by one tick."""
+        # check updates of speed
+        if self.direction == 1:
+            if self.speed < self.maxspeed:
+                self.speed += self.speedstep
+        elif self.direction == -1:
+            if self.speed > - self.maxspeed:
+                self.speed -= self.speedstep
+        else: # self.direction == 0
+            if self.speed > 0.00001:
+                self.speed -= self.speedstep
+            elif self.speed < -0.00001:
+                self.speed += self.speedstep
+            else:
+                self.speed = 0
+        if not self.defect:
+            self.position += self.speed/self.levels
+            # update position of elevator
+            if self.position < 0:
+                self.position = 0
+                self.motor_overheat += 1
+            elif self.position > 1:
+                self.position = 1
+                self.motor_overheat += 1
+            else:
+                # cool down
+                if self.motor_overheat > 0:
+                    self.motor_overheat -= 1
+            if self.motor_overheat >= self.overheat_max:
+                self.defect = True  # burnt out
+        if not self.door_defect:
+            # check door_motor
+            if self.door_motor == -1:
+                self.door_position -= self.door_step
+            elif self.door_motor == 1:
+                self.door_position += self.door_step
+            # update door
+            if self.door_position < 0:
+                self.door_position = 0
+                self.door_motor_overheat += 1
+            elif self.door_position > 1:
+                self.door_position = 1
+                self.door_motor_overheat += 1
+            else:
+                # cool down
+                if self.door_motor_overheat > 0:
+                    self.door_motor_overheat -= 1
+            if self.door_motor_overheat >= self.overheat_max:
+                self.door_defect = True
+
+    def up(self):
+        """Send elevator up. It will first accelerate a bit."""
+        self.direction = 1
+    def down(self):
+        """Send elevator down. It will first accelerate a bit."""
+        self.direction = -1
+    def stop(self):
+        """Stop elevator. It will first break a bit."""
+        self.direction = 0
+    def door_open(self):
+        """Set door motor to open."""
+        self.door_motor = 1
+    def door_close(self):
+        """Set door motor to close."""
+        self.door_motor = -1
+    def door_stop(self):
+        """Stop door motor."""
+        self.door_motor = 0
+    def repair(self):
+        """Repair the elevator motor."""
+        self.motor_overheat = 0
+        self.direction = 0
+        self.speed = 0
+        self.defect = False
+    def repair_door(self):
+        """ Repair the door motor."""
+        self.door_motor_overheat = 0
+        self.door_motor = 0
+        self.door_defect = False
+    def lamp_on(self, name):
+        self.button_lamps[name] = True
+    def lamp_off(self, name):
+        self.button_lamps[name] = False
+    def lamp(self, name):
+        return self.button_lamps[name]
+    def lamps_off(self):
+        """Switch all lamps off."""
+        self.set_lamps(0)
+    def set_lamps(self, mask):
+        """Switch the lamps to the bits of mask, in button_names() order."""
+        self.button_lamps.set_mask(mask)
+
+
+# levels, tick, position, speed, door position, direction, door motor,
+# defect, door defect, motor overheat, door motor overheat, overheat low
+# and max, maxspeed, speedstep, door step; followed by the pressed buttons
+# and the lit lamps as bit masks in button_names() order
+STATE = struct.Struct("<HQdddbb??iiiiddd")
+
+
+def save_state(elevator, tick=0):
+    """The complete state of elevator and the tick as compact bytes."""
+    e = elevator
+    return STATE.pack(e.levels, tick, e.position, e.speed, e.door_position,
+                      e.direction, e.door_motor, e.defect, e.door_defect,
+                      e.motor_overheat, e.door_motor_overheat,
+                      e.overheat_low, e.overheat_max, e.maxspeed,
+                      e.speedstep, e.door_step) + \
+        e.button_states.to_bytes() + e.button_lamps.to_bytes()
+
+
+def load_state(data, elevator=None):
+    """Restore save_state() bytes into elevator (a new ElevatorCore if
+    None, else one with the same levels); return the elevator and the tick."""
+    e = elevator
+    if len(data) < STATE.size:
+        raise ValueError("not an elevator state")
+    (levels, tick, position, speed, door_position, direction, door_motor,
+     defect, door_defect, motor_overheat, door_motor_overheat, overheat_low,
+     overheat_max, maxspeed, speedstep, door_step) = STATE.unpack_from(data)
+    if levels < 2:
+        raise ValueError("not an elevator state")
+    size = (len(_button_layout(levels)[0])+7)//8
+    if len(data) != STATE.size + 2*size:
+        raise ValueError("not an elevator state")
+    if e is None:
+        e = ElevatorCore(levels)
+    elif e.levels != levels:
+        raise ValueError("state of %d levels, elevator has %d"
+                         % (levels, e.levels))
+    e.position, e.speed, e.door_position = position, speed, door_position
+    e.direction, e.door_motor = direction, door_motor
+    e.defect, e.door_defect = defect, door_defect
+    e.motor_overheat, e.door_motor_overheat = motor_overheat, door_motor_overheat
+    e.overheat_low, e.overheat_max = overheat_low, overheat_max
+    e.maxspeed, e.speedstep, e.door_step = maxspeed, speedstep, door_step
+    end = STATE.size + size
+    e.button_states.set_mask(int.from_bytes(data[STATE.size:end], "little"))
+    e.button_lamps.set_mask(int.from_bytes(data[end:], "little"))
+    return e, tick
+
+
+class FixedStep:
+    """Accumulator of a fixed-timestep loop: due() tells how many steps of
+    1/rate seconds of wall-clock time passed since the last call."""
+    max_lag = 0.25  # seconds of backlog to catch up with, the rest is dropped
+
+    def __init__(self, rate, clock=time.perf_counter):
+        self.period = 1.0 / rate
+        self.clock = clock
+        self.last = clock()
+        self.accumulator = 0.0
+
+    def due(self):
+        now = self.clock()
+        self.accumulator = min(self.accumulator + now - self.last,
+                               max(self.max_lag, self.period))
+        self.last = now
+        steps = int(self.accumulator / self.period)
+        self.accumulator -= steps * self.period
+        return steps
+
+    def wait_time(self):
+        """Seconds until the next step is due."""
+        return max(0.0, self.period - self.accumulator
+                        - (self.clock() - self.last))
+
+
+class Simulation:
+    """Steps an elevator tick by tick, independent of any display.
+    rate is the number of ticks per second of wall-clock time,
+    None or 0 runs as fast as possible."""
+
+    def __init__(self, elevator, rate=TICK_RATE):
+        self.elevator = elevator
+        self.rate = rate
+        self.tick = 0
+        self.terminate = False
+        self.tick_hooks = []  # functions called with the simulation after each tick
+
+    def save(self):
+        """save_state() of the elevator at the current tick; the tick hooks
+        (controllers, recorders) are not part of it."""
+        return save_state(self.elevator, self.tick)
+
+    def restore(self, state):
+        """Continue from a save()d state of a building of the same height."""
+        self.elevator, self.tick = load_state(state, self.elevator)
+
+    @classmethod
+    def fork(cls, state, rate=None):
+        """A new simulation of a new elevator starting at a save()d state;
+        many independent runs can be forked from the same state."""
+        elevator, tick = load_state(state)
+        sim = cls(elevator, rate)
+        sim.tick = tick
+        return sim
+
+    def step(self):
+        """Advance the simulation by exactly one tick."""
+        self.elevator.update()
+        self.tick += 1
+        for hook in self.tick_hooks:
+            hook(self)
+
+    def run(self, ticks):
+        """Run ticks ticks as fast as possible."""
+        step = self.step
+        for _ in range(ticks):
+            step()
+        return self.tick
+
+    def run_forever(self, until=None):
+        """Run until terminate is set (or until() returns true), paced to
+        rate ticks per second."""
+        step = self.step
+        if not self.rate:
+            while not self.terminate and not (until and until()):
+                step()
+            return self.tick
+        physics = FixedStep(self.rate)
+        while True:
+            for _ in range(physics.due()):
+                if self.terminate or (until and until()):
+                    return self.tick
+                step()
+            time.sleep(physics.wait_time())
+
+
+def main(*arg):
+    """Run a headless simulation for a number of ticks and report
+    the final state and the achieved tick rate."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--levels", type=int, default=10)
+    parser.add_argument("--ticks", type=int, default=TICK_RATE*60)
+    parser.add_argument("--event-driven", action="store_true",
+                        help="skip ticks in which nothing happens")
+    parser.add_argument("--controller",
+                        help="in-process controller, a name or module:Class")
+    parser.add_argument("--telemetry", metavar="DIRECTORY",
+                        help="write the state of every tick to memory-mapped columns")
+    parser.add_argument("--load", metavar="STATE",
+                        help="start from a state saved with --save (and its levels)")
+    parser.add_argument("--save", metavar="STATE",
+                        help="save the final state to this file")
+    args = parser.parse_args(arg)
+    if args.event_driven:
+        from eventsim import EventSimulation as simulation_class
+    else:
+        simulation_class = Simulation
+    if args.load:
+        with open(args.load, "rb") as f:
+            try:
+                sim = simulation_class.fork(f.read())
+            except ValueError as e:
+                parser.error("%s: %s" % (args.load, e))
+    else:
+        sim = simulation_class(ElevatorCore(max(args.levels, 3)), rate=None)
+    if args.controller:
+        from controllers import load_controller
+        sim.tick_hooks.append(load_controller(args.controller)(sim.elevator))
+    elif not args.load:
+        sim.elevator.up()
+    if args.telemetry:
+        from telemetry import TelemetryRecorder
+        telemetry = TelemetryRecorder(args.telemetry, sim.elevator)
+        sim.tick_hooks.append(telemetry)
+    start = time.perf_counter()
+    sim.run(args.ticks)
+    elapsed = time.perf_counter() - start
+    if args.telemetry:
+        telemetry.close()
+    if args.save:
+        with open(args.save, "wb") as f:
+            f.write(sim.save())
+    elevator = sim.elevator
+    print("ticks: %d, level %02d, motor status: %s, %.0f ticks/s"
+          % (sim.tick, elevator.current_level(), elevator.motor_status(),
+             args.ticks / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main(*(sys.argv)[1:])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Telemetry of ELSIM
+the state of every tick appended to preallocated memory-mapped columns,
+one .npy file per column, used as a ring buffer of fixed size; other
+processes can open the files with load() while the simulation is running
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from simcore import TICK_RATE
+
+COLUMNS = (("tick", np.int64), ("position", np.float64),
+           ("speed", np.float64), ("door_position", np.float64),
+           ("motor_overheat", np.int32), ("door_motor_overheat", np.int32),
+           ("direction", np.int8), ("door_motor", np.int8))
+COUNT = "count.npy"  # rows written so far, readers see this many
+META = "meta.json"
+
+
+class TelemetryRecorder:
+    """Tick hook appending the state of elevator to the columns in
+    directory; the last capacity ticks are kept. Rows are collected in
+    memory and written flush_every ticks, so readers lag at most that."""
+    flush_every = TICK_RATE
+
+    def __init__(self, directory, elevator, capacity=TICK_RATE*3600):
+        self.elevator = elevator
+        self.capacity = capacity
+        os.makedirs(directory, exist_ok=True)
+        self.columns = [open_memmap(os.path.join(directory, name + ".npy"),
+                                    mode="w+", dtype=dtype, shape=(capacity,))
+                        for name, dtype in COLUMNS]
+        self.count = open_memmap(os.path.join(directory, COUNT), mode="w+",
+                                 dtype=np.int64, shape=(1,))
+        with open(os.path.join(directory, META), "w") as f:
+            json.dump({"levels": elevator.levels, "tick_rate": TICK_RATE,
+                       "capacity": capacity,
+                       "columns": [name for name, dtype in COLUMNS]}, f)
+        self.rows = []
+
+    def __call__(self, sim):
+        e = self.elevator
+        self.rows.append((sim.tick, e.position, e.speed, e.door_position,
+                          e.motor_overheat, e.door_motor_overheat,
+                          e.direction, e.door_motor))
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write the collected rows and then publish the new count."""
+        if not self.rows:
+            return
+        rows = self.rows[-self.capacity:]
+        written = int(self.count[0]) + len(self.rows) - len(rows)
+        start = written % self.capacity
+        first = min(len(rows), self.capacity - start)  # up to the wrap
+        for column, values in zip(self.columns, zip(*rows)):
+            column[start:start+first] = values[:first]
+            column[:len(rows)-first] = values[first:]
+        self.count[0] = written + len(rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        for column in self.columns:
+            column.flush()
+        self.count.flush()
+
+
+def load(directory):
+    """Return the recorded columns as a dict name -> array in tick order.
+    Until the ring buffer wrapped around the arrays are read-only views of
+    the files (no copy); afterwards the two halves are joined."""
+    count = int(np.load(os.path.join(directory, COUNT))[0])
+    result = {}
+    for name, dtype in COLUMNS:
+        column = np.load(os.path.join(directory, name + ".npy"),
+                         mmap_mode="r")
+        capacity = len(column)
+        if count <= capacity:
+            result[name] = column[:count]
+        else:
+            start = count % capacity
+            result[name] = np.concatenate((column[start:], column[:start]))
+    return result
+
+
+def main(*arg):
+    """Summarize a telemetry directory."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("directory")
+    args = parser.parse_args(arg)
+    columns = load(args.directory)
+    ticks = columns["tick"]
+    if not len(ticks):
+        print("no ticks recorded")
+        return
+    print("ticks %d to %d (%d rows)" % (ticks[0], ticks[-1], len(ticks)))
+    for name, dtype in COLUMNS[1:]:
+        values = columns[name]
+        print("%-20s min %-12.6g mean %-12.6g max %.6g"
+              % (name, values.min(), values.mean(), values.max()))
+
+
+if __name__ == '__main__':
+    main(*(sys.argv)[1:])
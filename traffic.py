@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Passenger traffic of ELSIM
+seeded Poisson arrivals of passengers which press the hall buttons, board
+when the car stands at their floor with the door open and goes their way,
+press the level button of their destination and leave there. Wait and
+journey times are kept per passenger so the quality of a controller can be
+measured.
+"""
+import sys
+import json
+import math
+import random
+import argparse
+from array import array
+
+from simcore import ElevatorCore, Simulation, TICK_RATE, PHYSICS
+
+
+def interfloor(rnd, levels):
+    origin = rnd.randrange(levels)
+    destination = rnd.randrange(levels-1)
+    if destination >= origin:
+        destination += 1
+    return origin, destination
+
+
+def up_peak(rnd, levels):
+    """Mostly from the lobby up, some interfloor traffic."""
+    if rnd.random() < 0.9:
+        return 0, rnd.randrange(1, levels)
+    return interfloor(rnd, levels)
+
+
+def down_peak(rnd, levels):
+    """Mostly down to the lobby, some interfloor traffic."""
+    if rnd.random() < 0.9:
+        return rnd.randrange(1, levels), 0
+    return interfloor(rnd, levels)
+
+
+PROFILES = {"interfloor": interfloor, "up-peak": up_peak,
+            "down-peak": down_peak}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values)-1, int(p/100.0*len(values)))]
+
+
+class Traffic:
+    """Passenger traffic for elevator as a tick hook. rate is the mean
+    number of arriving passengers per hour, tick_rate the simulated ticks
+    per second. heading() tells the direction the controller drives the
+    car (1, -1 or 0, like Controller.heading); without it the riders'
+    destinations tell."""
+
+    def __init__(self, elevator, profile="interfloor", rate=200, seed=0,
+                 tick_rate=TICK_RATE, heading=None):
+        if not rate >= 0:
+            raise ValueError("bad arrival rate %s" % rate)
+        self.elevator = elevator
+        self.heading = heading
+        self.levels = elevator.levels
+        self.profile = PROFILES[profile] if isinstance(profile, str) \
+                       else profile
+        self.random = random.Random(seed)
+        self.tick_rate = tick_rate
+        self.arrivals_per_tick = rate / 3600.0 / tick_rate
+        self.next_arrival = self._interarrival(0)
+        self.waiting = [[] for _ in range(self.levels)]  # (arrival, destination)
+        self.riding = [[] for _ in range(self.levels)]  # (arrival) by destination
+        self.calls = {}  # button name -> passengers who want it lit
+        self.held = []  # buttons pressed in the last tick
+        self.refused = set()  # hall calls not boarding the car standing here
+        self.refused_floor = None
+        self.arrived = 0
+        self.waits = array("d")  # ticks from arrival to boarding
+        self.journeys = array("d")  # ticks from arrival to leaving the car
+        self.first_tick = None
+
+    def _interarrival(self, tick):
+        if not self.arrivals_per_tick:
+            return math.inf  # nobody comes
+        return tick + 1 + int(-math.log(1.0 - self.random.random())
+                              / self.arrivals_per_tick)
+
+    def __call__(self, sim):
+        tick = sim.tick
+        elevator = self.elevator
+        if self.first_tick is None:
+            self.first_tick = tick
+            self.next_arrival = self._interarrival(tick)
+        # buttons are pressed for one tick
+        for name in self.held:
+            elevator.button_states[name] = False
+        self.held = []
+        if self.refused and elevator.current_level() != self.refused_floor:
+            self.refused.clear()  # the car left, call it again
+        while self.next_arrival <= tick:
+            origin, destination = self.profile(self.random, self.levels)
+            self.waiting[origin].append((self.next_arrival, destination))
+            self._want(self.hall_button(origin, destination), 1)
+            self.arrived += 1
+            self.next_arrival = self._interarrival(self.next_arrival)
+        floor = self.stopped_floor()
+        if floor is not None:
+            self.exchange(floor, tick)
+        self.press_buttons()
+
+    def stopped_floor(self):
+        """The floor where the car stands with the door open, or None."""
+        elevator = self.elevator
+        if elevator.speed == 0 and elevator.is_door_open() and \
+           elevator.save_to_open_door():
+            return elevator.current_level()
+        return None
+
+    def exchange(self, floor, tick):
+        riding = self.riding[floor]
+        if riding:
+            for arrival in riding:
+                self.journeys.append(tick - arrival)
+            self._want("level %d" % (floor+1), -len(riding))
+            self.riding[floor] = []
+        waiting = self.waiting[floor]
+        if not waiting:
+            return
+        direction = self.direction(floor)
+        staying = []
+        for arrival, destination in waiting:
+            if direction and (destination - floor)*direction < 0:
+                # the car goes the other way, wait for the next one
+                staying.append((arrival, destination))
+                self.refused.add(self.hall_button(floor, destination))
+                self.refused_floor = floor
+                continue
+            self.waits.append(tick - arrival)
+            self._want(self.hall_button(floor, destination), -1)
+            self.riding[destination].append(arrival)
+            self._want("level %d" % (destination+1), 1)
+        self.waiting[floor] = staying
+
+    def direction(self, floor):
+        """The direction the car standing at floor is committed to: its
+        heading while riders or lit lamps lie beyond floor that way, else 0
+        (everybody boards)."""
+        heading = self.heading() if self.heading else 0
+        if not heading:
+            for destination, riders in enumerate(self.riding):
+                if riders and destination != floor:
+                    heading = destination > floor and 1 or -1
+                    break
+            else:
+                return 0
+        for destination, riders in enumerate(self.riding):
+            if riders and (destination - floor)*heading > 0:
+                return heading
+        for name in self.elevator.button_lamps.on():
+            if (int(name.rsplit(" ", 1)[1]) - 1 - floor)*heading > 0:
+                return heading
+        return 0
+
+    @staticmethod
+    def hall_button(origin, destination):
+        return "%s %d" % (destination > origin and "up" or "down", origin+1)
+
+    def _want(self, name, passengers):
+        passengers += self.calls.get(name, 0)
+        if passengers:
+            self.calls[name] = passengers
+        else:
+            del self.calls[name]
+
+    def press_buttons(self):
+        """Press the buttons wanted by waiting and riding passengers whose
+        lamp is not lit (again, if the controller turned it off); who did
+        not board the car waits until it left."""
+        elevator = self.elevator
+        # test the lamp bits directly, this runs every tick
+        lit, index = elevator.button_lamps.bits, elevator.button_lamps.index
+        refused = self.refused
+        for name in self.calls:
+            if not lit >> index[name] & 1 and name not in refused:
+                elevator.button_states[name] = True
+                self.held.append(name)
+
+    def quiet_ticks(self, sim):
+        """Ticks until the next arrival, unless buttons are held or
+        passengers can board or leave (see eventsim.EventSimulation)."""
+        if self.held or self.refused or self.first_tick is None:
+            return 0
+        floor = self.stopped_floor()
+        if floor is not None and (self.waiting[floor] or self.riding[floor]):
+            return 0
+        return max(0, self.next_arrival - sim.tick - 1)
+
+    def metrics(self, tick):
+        """Wait and journey times in seconds and delivered passengers per
+        hour until tick."""
+        hours = (tick - (self.first_tick or tick)) / self.tick_rate / 3600.0
+        waits = [w / self.tick_rate for w in self.waits]
+        journeys = [j / self.tick_rate for j in self.journeys]
+        return {"arrived": self.arrived,
+                "boarded": len(waits),
+                "delivered": len(journeys),
+                "waiting": sum(len(w) for w in self.waiting),
+                "riding": sum(len(r) for r in self.riding),
+                "wait_mean": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p95": percentile(waits, 95),
+                "journey_mean": sum(journeys) / len(journeys) if journeys else 0.0,
+                "journey_p95": percentile(journeys, 95),
+                "passengers_per_hour": len(journeys) / hours if hours else 0.0}
+
+
+def simulate(levels=10, controller="collective", profile="interfloor",
+             rate=200, hours=1.0, seed=0, event_driven=True, **physics):
+    """Run one headless scenario and return its metrics; physics overrides
+    the simcore.PHYSICS of the elevator like maxspeed or overheat_max."""
+    from controllers import load_controller
+    if event_driven:
+        from eventsim import EventSimulation as simulation_class
+    else:
+        simulation_class = Simulation
+    elevator = ElevatorCore(levels)
+    for name, value in physics.items():
+        if name not in PHYSICS:
+            raise ValueError("unknown elevator parameter %s" % name)
+        setattr(elevator, name, value)
+    sim = simulation_class(elevator, rate=None)
+    controller = load_controller(controller)(sim.elevator)
+    sim.tick_hooks.append(controller)
+    traffic = Traffic(sim.elevator, profile, rate, seed,
+                      heading=lambda: controller.heading)
+    sim.tick_hooks.append(traffic)
+    sim.run(int(hours * 3600 * TICK_RATE))
+    return traffic.metrics(sim.tick)
+
+
+def main(*arg):
+    """Run passenger traffic against an in-process controller and print
+    the metrics as JSON."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--levels", type=int, default=10)
+    parser.add_argument("--controller", default="collective")
+    parser.add_argument("--profile", default="interfloor",
+                        choices=sorted(PROFILES))
+    parser.add_argument("--rate", type=float, default=200,
+                        help="arriving passengers per hour")
+    parser.add_argument("--hours", type=float, default=1.0,
+                        help="simulated hours")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tick-by-tick", action="store_true",
+                        help="do not skip quiet ticks")
+    args = parser.parse_args(arg)
+    if not args.rate >= 0:
+        parser.error("the rate cannot be negative")
+    print(json.dumps(simulate(max(args.levels, 3), args.controller,
+                              args.profile, args.rate, args.hours, args.seed,
+                              not args.tick_by_tick)))
+
+
+if __name__ == '__main__':
+    main(*(sys.argv)[1:])